@@ -1,7 +1,19 @@
+import os
+import time
+import uuid
 import streamlit as st
 import google.generativeai as genai
-import re
-from datetime import datetime
+from datetime import date, datetime
+
+from memo_pipeline import MODEL_NAME, count_input_token_savings, create_model, get_system_prompt, process_memo
+from fake_model import create_backend
+from history_store import HistoryStore
+from long_memo import LONG_MEMO_CHARS, process_long_memo
+from metrics import MetricsLog, classify_error
+from model_pool import ModelPool
+from rate_limit import estimate_tokens
+from response_cache import ResponseCache
+from scheduler import ScheduledModel, Scheduler
 
 # Page configuration
 st.set_page_config(
@@ -13,12 +25,13 @@ st.set_page_config(
 # Title
 st.title("📋 面談メモ整理ツール")
 
-# Initialize history in session state
-if "history" not in st.session_state:
-    st.session_state.history = []
+# Model backend: live (Gemini API), record (live, saving responses), replay
+# (saved responses, offline) or synthetic (generated output, offline)
+model_backend = st.secrets.get("MODEL_BACKEND", "live")
+api_key = st.secrets.get("GEMINI_API_KEY")
 
 # Get API key (using Gemini API)
-if "GEMINI_API_KEY" not in st.secrets:
+if model_backend in ("live", "record") and not api_key:
     st.error("⚠️ `.streamlit/secrets.toml` に `GEMINI_API_KEY` が設定されていません。")
     st.info("💡 Google Gemini APIキーは無料で取得できます。")
     st.markdown("""
@@ -30,149 +43,155 @@ if "GEMINI_API_KEY" not in st.secrets:
     """)
     st.stop()
 
-# Initialize Gemini API client
-genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-# Use lightweight model available in free tier
-model = genai.GenerativeModel('gemini-flash-lite-latest')
-
-def remove_placeholder_names(text, input_text):
-    """入力に無い人名を顧客に置換する"""
-    name_chars = r'[ァ-ヶーｦ-ﾟa-zA-Zぁ-ん\u4e00-\u9fff々]{2,}'
-    suffix = r'(?:さん|くん|ちゃん|君|様|氏)'
-    pattern = rf'({name_chars})({suffix})'
-
-    # 入力に登場する名前（敬称付き・なし両方）を収集
-    input_names = set()
-    for m in re.finditer(pattern, input_text):
-        input_names.add(m.group(1))
-
-    def replace_if_not_in_input(match):
-        name = match.group(1)
-        honorific = match.group(2)
-        # 入力に名前自体が含まれていれば許可
-        if name in input_names or name in input_text:
-            return match.group(0)
-        return '顧客'
-
-    return re.sub(pattern, replace_if_not_in_input, text)
-
-# Function to extract and remove unconfirmed items from generated text
-def extract_unconfirmed_items(text):
-    """未確認事項を抽出し、テキストから削除する"""
-    # Pattern to match: ⚠️ 未確認: or ⚠️ **未確認**: followed by items
-    pattern = r'⚠️\s*\*?\*?未確認\*?\*?:\s*([^\n]+)'
-    match = re.search(pattern, text)
-    
-    if match:
-        unconfirmed_items = match.group(1).strip()
-        # Remove the unconfirmed line and any separator lines around it
-        # Remove lines with ⚠️ 未確認 and surrounding separator lines (----)
-        text_cleaned = re.sub(r'-{4,}\s*\n\s*⚠️\s*\*?\*?未確認\*?\*?:\s*[^\n]+\s*\n\s*-{4,}', '', text, flags=re.MULTILINE)
-        text_cleaned = re.sub(r'⚠️\s*\*?\*?未確認\*?\*?:\s*[^\n]+', '', text_cleaned)
-        text_cleaned = re.sub(r'-{4,}\s*\n\s*-{4,}', '', text_cleaned)  # Remove double separators
-        text_cleaned = text_cleaned.strip()
-        return text_cleaned, unconfirmed_items
-    else:
-        return text.strip(), None
-
-# System prompt for AI (current_year and current_date are filled at runtime)
-def get_system_prompt():
-    now = datetime.now()
-    current_year = now.year
-    current_date = now.strftime("%Y年%m月%d日")
-    return f"""あなたはファイナンシャルプランナー（FP）の面談メモを整理・編集する専門家です。
-
-【人物名の扱い（最優先・厳守）】
-- **出力に使っていい名前は、入力テキストに実際に登場した名前だけ。** それ以外の名前は一切禁止。
-- 「入力に登場した名前」とは、入力テキスト内に「〇〇さん」「〇〇くん」「〇〇ちゃん」「〇〇」のように文字として書かれている人名のみ。
-- タカシ、田中、佐藤、山田など、過去の例や学習データに含まれるような名前を勝手に補完・使用することは絶対禁止。
-- 誰かと話したが名前が入力に無い場合は「顧客」と書く。架空・補完・推測の名前は一切使わない。
-- **人名はカタカナで表記すること。** 入力に「いさおさん」とあれば「イサオさん」、「あけみさん」とあれば「アケミさん」のようにカタカナに変換すること。ただし、入力に「ななちゃん」とあれば「ナナちゃん」のように、読み方は入力のままカタカナに変換すること（「ナミさん」など別の名前に変えるのは禁止）。
-- **入力に登場した異なる名前は、必ず別人物として区別すること。** 入力に「あけみさん」と「愛さん」が両方登場する場合は、それぞれ「アケミさん」「アイさん」として区別し、混同しないこと。
-
-【発言者の区別（最重要・厳守）】
-- **FP側が説明したことと、顧客が言ったことを明確に区別すること。**
-- 「お伝え」「説明した」「提案した」などの表現がある場合は、それがFP側の説明であることが文脈から明確になるように記載すること。
-- 特に「〜と思うとお伝え」「〜と説明した」のような表現がある場合、その「〜」の部分がFP側が説明した内容であることを明確にすること。顧客の発言のように誤解されないよう、主語や文の構造を調整すること。
-- 例：「それでもガンの自由診療はご家族が助かってほしいという気持ちがあるから残してほしいと思うとお伝え」→「それでもガンの自由診療特約については、ご家族が助かってほしいという気持ちがあるから残してほしいと説明し」のように、FP側が説明したことが明確になるように記載すること。
-- **「〜という意向があるため」「〜という意向がある」のような表現は、顧客の発言を示す場合にのみ使用すること。FP側が説明した内容を「〜という意向があるため」のように書いてはいけない。**
-- **入力に「〜と思うとお伝え」「〜と説明した」がある場合、その「〜」の部分は必ずFP側が説明した内容として記載すること。これを「〜という意向があるため」のように顧客の発言として書いてはいけない。**
-- 顧客の発言は「〇〇さんは〜と話した」「〇〇さんは〜とのこと」など、明確に主語を付けて記載すること。
-- FP側の説明が顧客の発言のように読まれないよう注意すること。必要に応じて主語を追加するか、文の構造を調整すること。
-
-【変換ルール】
-- 保険業界用語の補正を行ってください（例：iOSM→あいおい生命、20日7日→27日など）。
-- **生命保険会社名は、入力に明記されている場合はそのまま使用すること。** 入力に「あいおい」とあれば「あいおい生命」と記載し、「アオイ生命」など別の名前に変更しないこと。
-- 文体はカジュアルで簡潔なメモ調（「〜した」「〜の予定」など）にしてください。フォーマルな表現は不要です。
-- 誤変換や文脈の乱れを自然に補正してください。
-- 敬称は「様」ではなく「さん」を使用してください。
-- 「同席」と「共に説明を行った」は意味が異なる。「同席」は聞き手として参加していたことを意味し、「共に説明を行った」は説明者として参加したことを意味する。入力に「同席」とあれば、それを「共に説明を行った」に変更しないこと。入力に「〇〇さんも同席」とあれば、「〇〇さんも同席した」または「〇〇さんも同席して説明を行った」のように記載し、「〇〇さんと共に説明を行った」とは書かないこと。
-
-【ボイス入力の補正と用語の統一】
-- 入力はボイス入力（音声認識）であるため、聞き間違い・同音異義・そのまま文字になっただけの表現が含まれる。文脈や似たニュアンスから意味を汲み取り、**正しい保険・FP用語でメモとして書き足し・書き換え**して出力すること。
-- 次の用語は、言い換えや似た表現が話されていれば、出力では正式な用語で記載すること：
-  - 解約したときにもらえるお金・解約で戻るお金 → **解約返戻金**
-  - 保険を扱っている会社・保険の会社 → **保険会社**
-  - 市場の価格で調整する・時価調整・価格の調整 → **市場価格調整**
-  - 定期的に払うお金・毎月の支払い・定期の支払 → **定期支払金**（ただし、保険料の合計を表す場合は「保険料」を使用すること）
-  - 生命保険会社名は必ず正式名称で記載すること。以下の変換を厳守すること：
-    - **あいおい・アイオイ・あいおい生命・iOSM → あいおい生命**（絶対に「アオイ生命」と書かないこと。入力に「あいおい」とあれば必ず「あいおい生命」と記載すること）
-    - にほん・ニホン・日本生命 → **日本生命**
-    - すみとも・住友生命 → **住友生命**
-    - だいいち・第一生命 → **第一生命**
-    - めいじ・明治安田生命 → **明治安田生命**
-    - かんぽ・かんぽ生命 → **かんぽ生命**
-    - その他の生命保険会社名も、入力に近い読み方から正式名称を推測し、「〇〇生命」の形式で記載すること。
-    - **入力に生命保険会社名が明記されている場合は、その読み方を尊重し、勝手に別の名前に変更しないこと。**
-  - 就寝保険・終身ほけん・しゅうしんほけん・終身の保険 → **終身保険**
-- 上記に限らず、保険・年金・資産運用などで使う正式な用語が推測できる場合は、その用語で出力に反映すること。入力の「そのまま」ではなく、**こういうメモとして残すべき形**に整えて出力すること。
-
-【重要：不明な情報の扱い】
-- 情報が不明な場合は、その項目を完全に省略してください。「不明」「不明の教室」「不明な場合」などの記述は一切不要です。
-- 推測できない情報は書かないでください。空欄にするか、その項目自体を省略してください。
-
-【不足情報のチェック】
-以下の要素が入力内容に含まれているか確認してください：
-1. 面談日時・形式
-2. 決定事項・次回の予定
-3. ToDo
-
-これらが明確に含まれていない場合、出力の一番下に「⚠️ 未確認: （不足項目をカンマ区切りで列挙）」とだけ短く追記してください。
-全て揃っている場合は、この警告行は表示しないでください。
-
-【日付・西暦の扱い（必須）】
-- **西暦が入力に含まれていない場合、ユーザーが言わなくても必ず現在の西暦（{current_year}年）で補完すること。** 今日は{current_date}。年を省略した日付（例：27日、3月15日、来月5日）はすべて「{current_year}年」をつけて出力すること。
-- 面談日時・予定・期日などは、必ず「YYYY年MM月DD日」のように**期日まで省略せずに**書くこと。
-
-【出力フォーマット】
-以下の構成を厳守してください。**各セクション（■で始まる見出し）の前後には必ず空行を1行入れること。** 見出しと内容の間にも空行を入れること。
-
---------------------------------------------------
-■面談日時・形式
-YYYY年MM月DD日 HH:MM〜（形式）
-※情報が不明な場合はこの項目を省略してください。日付がある場合は上記のルールで年を補完し、期日まで記載すること
-
-■面談概要
-（今回の面談のテーマを1〜2文で。詳細内容・決定事項・ToDoに書く内容は繰り返さない）
-
-■詳細内容
-（箇条書きで話した内容を記載。面談概要・決定事項・ToDoと重複する内容は書かない）
-※「検討した」ではなく「話した」「説明した」「話し合った」などの表現を使用
-
-■決定事項・今後の予定
-（決まったこと・次回の予定のみ。詳細内容と重複する内容は書かない）
-※情報が不明な場合はこの項目を省略してください
+# Initialize Gemini API client once per process (Streamlit reruns this script on every interaction)
+@st.cache_resource
+def configure_gemini(api_key):
+    genai.configure(api_key=api_key)
+
+# Server-wide queue for API calls: admits them under the key's per-minute quota,
+# sends identical concurrent prompts once and takes turns between sessions
+@st.cache_resource
+def get_scheduler(requests_per_minute, tokens_per_minute, max_concurrent):
+    return Scheduler(requests_per_minute, tokens_per_minute, max_concurrent=max_concurrent)
+
+scheduler = get_scheduler(
+    int(st.secrets.get("SCHEDULER_RPM", 15)),
+    int(st.secrets.get("SCHEDULER_TPM", 250000)),
+    int(st.secrets.get("SCHEDULER_CONCURRENCY", 4))
+)
+if "scheduler_session" not in st.session_state:
+    st.session_state.scheduler_session = uuid.uuid4().hex
+scheduler_session = st.session_state.scheduler_session
+# The system instruction is sent with every request and counts against the token
+# quota; it embeds today's date, so it is rebuilt only when the date changes
+@st.cache_resource(max_entries=2)
+def get_system_tokens(day):
+    return estimate_tokens(get_system_prompt(datetime.fromisoformat(day)))
+
+system_tokens = get_system_tokens(date.today().isoformat())
+
+# Use lightweight model available in free tier. The system prompt embeds today's
+# date, so the model (and its system instruction) is rebuilt only when the date changes
+@st.cache_resource(max_entries=2)
+def get_model(api_key, day, context_cache, backend, recordings_dir, latency, error_rates, model_pool, hedge_after, hedge_percentile, cooldown, _rate_limiter=None):
+    def create_live_model():
+        configure_gemini(api_key)
+        if not model_pool:
+            return create_model(MODEL_NAME, context_cache=context_cache)
+        # Ordered fallback models; entries with their own key use a separate quota
+        return ModelPool(
+            [
+                (name, create_model(name, context_cache=context_cache, api_key=pool_key))
+                for name, pool_key in model_pool
+            ],
+            hedge_after=hedge_after,
+            hedge_percentile=hedge_percentile,
+            cooldown=cooldown,
+            # Hedges and failovers count against the scheduler's budget too
+            rate_limiter=_rate_limiter,
+            system_tokens=get_system_tokens(day)
+        )
+
+    return create_backend(backend, create_live_model, recordings_dir, latency=latency, error_rates=dict(error_rates))
+
+# Model without system instruction, used only for counting tokens
+@st.cache_resource
+def get_counting_model(api_key):
+    configure_gemini(api_key)
+    return genai.GenerativeModel(MODEL_NAME)
+
+model = get_model(
+    api_key,
+    date.today().isoformat(),
+    bool(st.secrets.get("GEMINI_CONTEXT_CACHE", False)),
+    model_backend,
+    st.secrets.get("RECORDINGS_DIR", os.path.join(st.secrets.get("DATA_DIR", "data"), "recordings")),
+    float(st.secrets.get("FAKE_LATENCY", 0.0)),
+    tuple(sorted(st.secrets.get("FAKE_ERROR_RATES", {}).items())),
+    tuple((entry["model"], entry.get("api_key")) for entry in st.secrets.get("MODEL_POOL", [])),
+    float(st.secrets.get("HEDGE_AFTER_SECONDS", 10.0)),
+    st.secrets.get("HEDGE_PERCENTILE", 95),
+    float(st.secrets.get("BREAKER_COOLDOWN_SECONDS", 60.0)),
+    scheduler.rate_limiter
+)
+# The cache key names the primary model; the fake backends use their own name
+# so that their output is never served as a live answer
+model_name = model.model_name if model_backend in ("synthetic", "replay") else (st.secrets.get("MODEL_POOL") or [{"model": MODEL_NAME}])[0]["model"]
+
+# Response cache shared by all sessions (avoids re-sending the same memo)
+@st.cache_resource
+def get_response_cache(directory, max_entries, ttl_hours):
+    return ResponseCache(directory, max_entries=max_entries, ttl_seconds=int(ttl_hours * 3600))
+
+response_cache = get_response_cache(
+    st.secrets.get("DATA_DIR", "data"),
+    int(st.secrets.get("CACHE_MAX_ENTRIES", 500)),
+    float(st.secrets.get("CACHE_TTL_HOURS", 24))
+)
 
-■ToDo
-（やること。決定事項・今後の予定と重複する内容は書かない）
-※なしの場合は「なし」と記述、情報が不明な場合はこの項目を省略してください
+# Generation history persisted in SQLite; one store for the server, rows
+# scoped to an owner key
+@st.cache_resource
+def get_history_store(directory):
+    return HistoryStore(directory)
+
+history_store = get_history_store(st.secrets.get("DATA_DIR", "data"))
+# The app has no login, so the owner key is a random ID kept in the URL
+# (?owner=...); reloading or bookmarking the page keeps the same history
+if "history_owner" not in st.session_state:
+    st.session_state.history_owner = st.query_params.get("owner") or uuid.uuid4().hex
+history_owner = st.session_state.history_owner
+st.query_params["owner"] = history_owner
+
+# Per-stage latency and token metrics (append-only log, optional Prometheus export)
+@st.cache_resource
+def get_metrics_log(directory, prometheus_file, prometheus_port):
+    metrics_log = MetricsLog(directory, prometheus_file=prometheus_file)
+    if prometheus_port:
+        metrics_log.serve_prometheus(prometheus_port)
+    return metrics_log
+
+metrics_log = get_metrics_log(
+    st.secrets.get("DATA_DIR", "data"),
+    st.secrets.get("METRICS_PROMETHEUS_FILE"),
+    int(st.secrets.get("METRICS_PROMETHEUS_PORT", 0))
+)
 
-（不足がある場合のみ以下を表示）
---------------------------------------------------
-⚠️ **未確認**: （不足項目名）, （不足項目名）
---------------------------------------------------
-"""
+MODE_LABELS = {"stream": "ストリーミング", "batch": "一括", "cache": "キャッシュ", "chunked": "分割並列"}
+ERROR_MESSAGES = {
+    "connection": (
+        "❌ **接続エラーが発生しました**",
+        "インターネット接続を確認してください。VPNを使用している場合は、VPNの接続状態を確認してください。"
+    ),
+    "auth": (
+        "❌ **APIキーエラーが発生しました**",
+        "APIキーが正しく設定されているか確認してください。`.streamlit/secrets.toml` ファイルを確認してください。"
+    ),
+    "quota": (
+        "❌ **リクエスト制限に達しました**",
+        "Gemini APIの無料枠には1分あたりのリクエスト数に制限があります。しばらく待ってから再試行してください。"
+    ),
+    "timeout": (
+        "❌ **タイムアウトエラーが発生しました**",
+        "リクエストがタイムアウトしました。インターネット接続を確認して、もう一度お試しください。"
+    )
+}
+long_memo_chars = int(st.secrets.get("LONG_MEMO_CHARS", LONG_MEMO_CHARS))
+
+def show_queue_status(placeholder):
+    """スケジューラーの待ち行列での順番と残り時間を placeholder に表示する関数を返す"""
+    def on_wait(position, eta):
+        if position:
+            placeholder.info(f"⏳ 順番待ち: {position}番目（あと約{eta:.0f}秒）")
+        else:
+            placeholder.info(f"🤖 AIがメモを整理中...（あと約{eta:.0f}秒）")
+    return on_wait
 
+with st.sidebar:
+    measure_token_savings = st.toggle(
+        "📉 入力トークンの削減量を表示",
+        help="用語辞書をプロンプトに含めていた場合と比べた入力トークン数を計測します（トークン数の計測APIを追加で呼び出します）"
+    )
 
 # Layout: left and right columns
 col_left, col_right = st.columns([1, 1])
@@ -185,6 +204,7 @@ with col_left:
         placeholder="例：今日は生命保険について相談がありました。27日の午後2時から面談予定です。..."
     )
     
+    stream_mode = st.toggle("⚡ ストリーミング表示（生成中の内容を順次表示）", value=True)
     generate_button = st.button("🚀 メモを整理", type="primary", use_container_width=True)
 
 with col_right:
@@ -194,94 +214,156 @@ with col_right:
         if not input_text.strip():
             st.warning("⚠️ 入力テキストが空です。メモを入力してください。")
         else:
-            with st.spinner("AIがメモを整理中..."):
-                try:
-                    # Call Gemini API (free tier available)
-                    current_year = datetime.now().year
-                    prompt = f"{get_system_prompt()}\n\n以下のメモを整理して整形してください。\n※現在の西暦は {current_year} 年です。年が指定されていない日付は必ず「{current_year}年」で補完すること。\n※入力に人名が含まれていない場合、タカシさん等の架空の名前は絶対に出力しないこと。\n\n{input_text}"
-                    response = model.generate_content(
-                        prompt,
-                        generation_config=genai.types.GenerationConfig(
-                            temperature=0.3,
-                        )
+            try:
+                # Call Gemini API (free tier available)
+                stream_area = st.empty()
+                stream_area.info("🤖 AIがメモを整理中...")
+                if long_memo_chars and len(input_text) > long_memo_chars:
+                    # Long transcripts are split and the parts are processed in parallel;
+                    # the parts wait in the queue from worker threads, so only the progress is shown
+                    scheduled_model = ScheduledModel(scheduler, model, scheduler_session, system_tokens)
+                    result = process_long_memo(
+                        scheduled_model,
+                        input_text,
+                        model_name=model_name,
+                        cache=response_cache,
+                        on_progress=lambda done, total: stream_area.progress(done / total, text=f"長文を分割して処理中... {done}/{total}")
                     )
-                    
-                    generated_text = response.text
-                    
-                    # Extract unconfirmed items and clean the text
-                    cleaned_text, unconfirmed_items = extract_unconfirmed_items(generated_text)
-                    # 入力に無い架空の人名を顧客に置換
-                    cleaned_text = remove_placeholder_names(cleaned_text, input_text)
-                    
-                    # Display unconfirmed items if any
-                    if unconfirmed_items:
-                        st.warning(f"⚠️ **未確認**: {unconfirmed_items}")
-                    
-                    # Add to history (latest entry at the beginning)
-                    history_entry = {
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "input": input_text,
-                        "output": cleaned_text,
-                        "unconfirmed": unconfirmed_items
-                    }
-                    st.session_state.history.insert(0, history_entry)
-                    
-                    # Keep maximum 50 history entries
-                    if len(st.session_state.history) > 50:
-                        st.session_state.history = st.session_state.history[:50]
-                    
-                    # Display generated result (session state を上書きして最新結果を表示)
-                    st.session_state["output_text"] = cleaned_text
-                    st.text_area(
-                        "整理されたメモ",
-                        value=cleaned_text,
-                        height=400,
-                        key="output_text"
+                else:
+                    scheduled_model = ScheduledModel(scheduler, model, scheduler_session, system_tokens, on_wait=show_queue_status(stream_area))
+                    result = process_memo(
+                        scheduled_model,
+                        input_text,
+                        model_name=model_name,
+                        cache=response_cache,
+                        stream=stream_mode,
+                        on_update=stream_area.text
                     )
-                    
-                    # Code block for clipboard copy (easy to select)
-                    st.markdown("**📋 コピー用（全選択してCtrl+C）**")
-                    st.code(cleaned_text, language=None)
-                    
-                except Exception as e:
-                    error_message = str(e)
-                    
-                    # Convert error messages to Japanese
-                    if "Connection" in error_message or "connection" in error_message or "failed" in error_message.lower():
-                        st.error("❌ **接続エラーが発生しました**")
-                        st.warning("インターネット接続を確認してください。VPNを使用している場合は、VPNの接続状態を確認してください。")
-                    elif "API key" in error_message or "api_key" in error_message or "authentication" in error_message.lower():
-                        st.error("❌ **APIキーエラーが発生しました**")
-                        st.warning("APIキーが正しく設定されているか確認してください。`.streamlit/secrets.toml` ファイルを確認してください。")
-                    elif "quota" in error_message.lower() or "rate limit" in error_message.lower() or "limit" in error_message.lower():
-                        st.error("❌ **リクエスト制限に達しました**")
-                        st.warning("Gemini APIの無料枠には1分あたりのリクエスト数に制限があります。しばらく待ってから再試行してください。")
-                    elif "timeout" in error_message.lower():
-                        st.error("❌ **タイムアウトエラーが発生しました**")
-                        st.warning("リクエストがタイムアウトしました。インターネット接続を確認して、もう一度お試しください。")
-                    else:
-                        st.error(f"❌ **エラーが発生しました**")
-                        st.warning(f"エラー内容: {error_message}")
-                    
-                    st.info("💡 問題が解決しない場合は、APIキーが正しく設定されているか、インターネット接続を確認してください。")
+                stream_area.empty()
+                render_started_at = time.perf_counter()
+                cleaned_text = result["output"]
+                unconfirmed_items = result["unconfirmed"]
+                latency = result["latency"]
+                
+                # Display unconfirmed items if any
+                if unconfirmed_items:
+                    st.warning(f"⚠️ **未確認**: {unconfirmed_items}")
+                
+                # Add to history and open it in the history list
+                history_entry = {
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "input": input_text,
+                    "output": cleaned_text,
+                    "unconfirmed": unconfirmed_items,
+                    "latency": latency
+                }
+                st.session_state.history_selected = history_store.add(history_entry, history_owner)
+                st.session_state.history_page = 0
+                
+                # Display generated result (session state を上書きして最新結果を表示)
+                st.session_state["output_text"] = cleaned_text
+                st.text_area(
+                    "整理されたメモ",
+                    value=cleaned_text,
+                    height=400,
+                    key="output_text"
+                )
+                
+                # Code block for clipboard copy (easy to select)
+                st.markdown("**📋 コピー用（全選択してCtrl+C）**")
+                st.code(cleaned_text, language=None)
+                
+                # Latency for comparing streaming and batch modes
+                mode_label = MODE_LABELS[latency["mode"]]
+                st.caption(f"⏱️ {mode_label}: 初回表示まで {latency['ttft']:.2f}秒 / 合計 {latency['total']:.2f}秒")
+                metrics_log.record({
+                    "mode": latency["mode"],
+                    "status": "ok",
+                    "input_chars": len(input_text),
+                    # The scheduler wait happens inside generate_content; it is counted as queue time
+                    "stages": {
+                        **scheduled_model.move_wait_to_queue(result["stages"]),
+                        "render": round(time.perf_counter() - render_started_at, 4)
+                    },
+                    "tokens": result["tokens"],
+                    "shared": scheduled_model.shared
+                })
+                
+                if measure_token_savings:
+                    # Offline backends count tokens themselves
+                    counting_model = get_counting_model(api_key) if model_backend in ("live", "record") else model
+                    savings = count_input_token_savings(counting_model, input_text)
+                    st.caption(f"📉 入力トークン: {savings['before']:,} → {savings['after']:,}（{savings['saved']:,} 削減）")
+                
+            except Exception as e:
+                metrics_log.record_error(e, input_chars=len(input_text))
+                # Japanese message chosen by the exception type
+                error_class = classify_error(e)
+                if error_class in ERROR_MESSAGES:
+                    title, advice = ERROR_MESSAGES[error_class]
+                    st.error(title)
+                    st.warning(advice)
+                else:
+                    st.error(f"❌ **エラーが発生しました**")
+                    st.warning(f"エラー内容: {e}")
+                
+                st.info("💡 問題が解決しない場合は、APIキーが正しく設定されているか、インターネット接続を確認してください。")
     else:
         st.info("👈 左側に入力テキストを貼り付けて、「メモを整理」ボタンをクリックしてください。")
 
-# History section
+# History section: only one page of summaries is fetched per rerun, and only
+# the opened entry renders its text areas
+HISTORY_PAGE_SIZE = 10
 st.markdown("---")
 st.subheader("📚 生成履歴")
 
-if st.session_state.history:
-    # Clear history button
+history_query = st.text_input(
+    "🔍 履歴を検索",
+    placeholder="顧客名・保険会社・日付で検索（例：イサオ あいおい生命 2026-10-18）"
+)
+if st.session_state.get("history_last_query") != history_query:
+    st.session_state.history_last_query = history_query
+    st.session_state.history_page = 0
+history_page = st.session_state.get("history_page", 0)
+history_rows, history_total = history_store.search(
+    history_owner,
+    history_query,
+    offset=history_page * HISTORY_PAGE_SIZE,
+    limit=HISTORY_PAGE_SIZE
+)
+
+if history_total:
+    # Clear history button (only this owner's history; ask before deleting)
     col1, col2 = st.columns([1, 5])
     with col1:
-        if st.button("🗑️ 履歴をクリア", type="secondary"):
-            st.session_state.history = []
+        if st.session_state.get("confirm_clear_history"):
+            if st.button("⚠️ 本当に履歴を削除", type="primary"):
+                history_store.clear(history_owner)
+                st.session_state.confirm_clear_history = False
+                st.rerun()
+        elif st.button("🗑️ 履歴をクリア", type="secondary"):
+            st.session_state.confirm_clear_history = True
             st.rerun()
+    with col2:
+        first = history_page * HISTORY_PAGE_SIZE + 1
+        st.caption(f"{history_total:,} 件中 {first:,}〜{first + len(history_rows) - 1:,} 件目")
     
-    # Display history (expandable format)
-    for idx, entry in enumerate(st.session_state.history):
-        with st.expander(f"📄 {entry['timestamp']}", expanded=(idx == 0)):
+    for row in history_rows:
+        is_open = row["id"] == st.session_state.get("history_selected")
+        col_title, col_open = st.columns([6, 1])
+        with col_title:
+            preview = row["preview"].replace("\n", " ")
+            warning_mark = " ⚠️" if row["unconfirmed"] else ""
+            st.markdown(f"📄 **{row['timestamp']}**{warning_mark}　{preview}…")
+        with col_open:
+            if st.button("閉じる" if is_open else "開く", key=f"history_open_{row['id']}", use_container_width=True):
+                st.session_state.history_selected = None if is_open else row["id"]
+                st.rerun()
+        if not is_open:
+            continue
+        
+        entry = history_store.get(row["id"], history_owner)
+        with st.container(border=True):
             col_input, col_output = st.columns([1, 1])
             
             with col_input:
@@ -290,30 +372,84 @@ if st.session_state.history:
                     "入力テキスト",
                     value=entry['input'],
                     height=200,
-                    key=f"history_input_{idx}",
+                    key=f"history_input_{entry['id']}",
                     label_visibility="collapsed"
                 )
             
             with col_output:
                 st.markdown("**📄 生成結果**")
-                # Display unconfirmed items if any (for backward compatibility, check if exists)
-                if 'unconfirmed' in entry and entry['unconfirmed']:
+                # Display unconfirmed items if any
+                if entry['unconfirmed']:
                     st.warning(f"⚠️ **未確認**: {entry['unconfirmed']}")
                 st.text_area(
                     "生成結果",
                     value=entry['output'],
                     height=200,
-                    key=f"history_output_{idx}",
+                    key=f"history_output_{entry['id']}",
                     label_visibility="collapsed"
                 )
             
             # Code block for clipboard copy
             st.markdown("**📋 コピー用（全選択してCtrl+C）**")
             st.code(entry['output'], language=None)
-            st.markdown("---")
+            if entry['latency']:
+                mode_label = MODE_LABELS[entry['latency']['mode']]
+                st.caption(f"⏱️ {mode_label}: 初回表示まで {entry['latency']['ttft']:.2f}秒 / 合計 {entry['latency']['total']:.2f}秒")
+    
+    # Pagination
+    page_count = (history_total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    if page_count > 1:
+        col_prev, col_page, col_next = st.columns([1, 4, 1])
+        with col_prev:
+            if st.button("◀ 前へ", disabled=history_page == 0, use_container_width=True):
+                st.session_state.history_page = history_page - 1
+                st.rerun()
+        with col_page:
+            st.caption(f"{history_page + 1} / {page_count} ページ")
+        with col_next:
+            if st.button("次へ ▶", disabled=history_page + 1 >= page_count, use_container_width=True):
+                st.session_state.history_page = history_page + 1
+                st.rerun()
+elif history_query:
+    st.info("🔍 条件に一致する履歴はありません。")
 else:
     st.info("📝 履歴はまだありません。メモを整理すると、ここに履歴が表示されます。")
 
+# Sidebar: response cache statistics
+with st.sidebar:
+    if model_backend != "live":
+        st.caption(f"🧪 モデルのバックエンド: {model_backend}")
+    if isinstance(model, ModelPool):
+        st.subheader("🔀 モデルプール")
+        for member in model.status():
+            state = {"closed": "🟢", "half-open": "🟡", "open": "🔴"}[member["state"]]
+            p95 = f"{member['p95']:.2f}秒" if member["p95"] is not None else "-"
+            retry = f"（あと {member['retry_in']:.0f}秒）" if member["state"] == "open" else ""
+            st.caption(f"{state} {member['name']}{retry} / p95 {p95} / 応答 {member['wins']} 件")
+        st.caption(f"ヘッジ送信: {model.hedges} 回")
+    st.subheader("🚦 送信キュー")
+    scheduler_status = scheduler.status()
+    col_queued, col_running = st.columns(2)
+    col_queued.metric("待ち", scheduler_status["queued"])
+    col_running.metric("送信中", scheduler_status["running"])
+    st.caption(
+        f"送信 {scheduler_status['sent']} 件 / 相乗り {scheduler_status['shared']} 件 / 再送 {scheduler_status['retried']} 件"
+        f"（上限 {scheduler.rate_limiter.requests_per_minute} 件/分）"
+    )
+    if model.cached_content:
+        st.caption("🧊 システムプロンプトはGeminiのコンテキストキャッシュを使用中")
+    st.subheader("🗄️ 応答キャッシュ")
+    cache_stats = response_cache.stats()
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    col_hits, col_misses = st.columns(2)
+    col_hits.metric("ヒット", cache_stats["hits"])
+    col_misses.metric("ミス", cache_stats["misses"])
+    hit_rate = f"{cache_stats['hits'] / lookups:.0%}" if lookups else "-"
+    st.caption(f"ヒット率: {hit_rate} / 保存件数: {cache_stats['entries']}")
+    if st.button("🗑️ キャッシュを削除", type="secondary"):
+        response_cache.clear()
+        st.rerun()
+
 # Footer
 st.markdown("---")
 st.caption("🆓 Google Gemini APIを使用しているため、完全無料で利用できます。")
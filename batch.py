@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from fake_model import create_backend
+from long_memo import LONG_MEMO_CHARS, process_long_memo
+from memo_pipeline import MODEL_NAME, create_model, get_system_prompt, process_memo
+from metrics import MetricsLog, classify_error
+from model_pool import ModelPool
+from rate_limit import RateLimiter, estimate_tokens
+from response_cache import ResponseCache
+
+
+def read_memos(path):
+    """ディレクトリ（*.txt, *.md）またはJSONLファイルから (id, メモ本文) を順に返す"""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith((".txt", ".md")):
+                with open(os.path.join(path, name), encoding="utf-8") as f:
+                    yield os.path.splitext(name)[0], f.read()
+        return
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield str(record.get("id", line_no)), record.get("input") or record.get("text", "")
+
+
+def is_quota_error(error):
+    """クォータ超過（429）のエラーかどうか"""
+    return classify_error(error) == "quota"
+
+
+def call_with_retry(call, max_retries=5, base_delay=2.0, on_error=None):
+    """call() を実行し、クォータエラー時は指数バックオフで再試行する（on_error は失敗のたびに呼ばれる）"""
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if on_error is not None:
+                on_error(e)
+            if not is_quota_error(e) or attempt == max_retries:
+                raise
+            # Exponential backoff with jitter so workers do not retry in lockstep
+            time.sleep(base_delay * 2 ** attempt * (0.5 + random.random()))
+
+
+def process_with_retry(model, memo_id, input_text, rate_limiter, max_retries=5, base_delay=2.0, long_memo_chars=None, metrics_log=None, **kwargs):
+    """メモを1件処理し、クォータエラー時は指数バックオフで再試行する（長いメモはチャンクごとに再試行する）"""
+    failures = []
+
+    def record_failure(error):
+        failures.append(error)
+        if metrics_log is not None:
+            # Every failed attempt is recorded, so quota pressure shows up even when a retry succeeds
+            metrics_log.record_error(error, source="batch", input_chars=len(input_text))
+
+    def retrying(call):
+        return call_with_retry(call, max_retries, base_delay, on_error=record_failure)
+
+    try:
+        if long_memo_chars and len(input_text) > long_memo_chars:
+            # Long transcripts are split and processed in parallel chunks; a
+            # quota error retries only its chunk, not the chunks already done
+            result = process_long_memo(model, input_text, rate_limiter=rate_limiter, retry=retrying, **kwargs)
+        else:
+            result = retrying(lambda: process_memo(model, input_text, rate_limiter=rate_limiter, **kwargs))
+    except Exception as e:
+        if not any(failure is e for failure in failures):
+            record_failure(e)
+        return {"id": memo_id, "error": f"{type(e).__name__}: {e}", "attempts": len(failures)}
+    if metrics_log is not None:
+        metrics_log.record({
+            "source": "batch",
+            "mode": result["latency"]["mode"],
+            "status": "ok",
+            "input_chars": len(input_text),
+            "stages": result["stages"],
+            "tokens": result["tokens"]
+        })
+    return {"id": memo_id, **result, "attempts": len(failures) + 1}
+
+
+def run_batch(memos, out, model, rate_limiter, workers=4, **kwargs):
+    """メモを並列処理し、完了した順に結果をJSONLとして書き出す"""
+    counts = {"ok": 0, "partial": 0, "error": 0}
+
+    def write_results(futures):
+        for future in futures:
+            result = future.result()
+            # A long memo with chunks that failed for other reasons is written but not counted as a success
+            counts["error" if "error" in result else "partial" if result.get("failed_chunks") else "ok"] += 1
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Only a bounded number of memos are in flight, so memory stays flat
+        pending = set()
+        for memo_id, input_text in memos:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write_results(done)
+            pending.add(executor.submit(process_with_retry, model, memo_id, input_text, rate_limiter, **kwargs))
+        write_results(wait(pending).done)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="面談メモをまとめて整理し、結果をJSONLで出力する")
+    parser.add_argument("input", help="メモ（*.txt, *.md）のディレクトリ、または {\"id\", \"input\"} 形式のJSONLファイル")
+    parser.add_argument("-o", "--output", default="-", help="出力JSONLファイル（省略時は標準出力）")
+    parser.add_argument("--workers", type=int, default=4, help="同時実行数")
+    parser.add_argument("--rpm", type=float, default=15, help="1分あたりのリクエスト数上限")
+    parser.add_argument("--tpm", type=float, default=250000, help="1分あたりの入力トークン数上限")
+    parser.add_argument("--max-retries", type=int, default=5, help="クォータエラー時の最大再試行回数")
+    parser.add_argument("--data-dir", default="data", help="応答キャッシュの保存先")
+    parser.add_argument("--no-cache", action="store_true", help="応答キャッシュを使わない")
+    parser.add_argument("--long-memo-chars", type=int, default=LONG_MEMO_CHARS, help="これより長いメモは分割して並列処理する（0で無効）")
+    parser.add_argument("--models", default=MODEL_NAME, help="使うモデル（カンマ区切りで優先順。2つ以上でヘッジ・切り替えを行う）")
+    parser.add_argument("--hedge-after", type=float, default=10.0, help="応答が遅いとき次のモデルにも送るまでの秒数（応答時間の記録が貯まると p95 に切り替わる）")
+    parser.add_argument("--context-cache", action="store_true", help="システムプロンプトをGeminiのコンテキストキャッシュに載せる（対応モデルのみ）")
+    parser.add_argument("--fake", action="store_true", help="APIを呼ばずにテスト用モデルで処理する")
+    parser.add_argument("--record", metavar="DIR", help="APIの応答をプロンプトごとに DIR に記録する")
+    parser.add_argument("--replay", metavar="DIR", help="APIを呼ばずに DIR に記録した応答を返す")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="テスト用モデル（--fake, --replay）の応答時間（秒）")
+    parser.add_argument("--fake-quota-error-rate", type=float, default=0.0, help="テスト用モデル（--fake, --replay）がクォータエラーを返す確率")
+    args = parser.parse_args(argv)
+    rate_limiter = RateLimiter(args.rpm, args.tpm)
+
+    def create_live_model():
+        import google.generativeai as genai
+        if "GEMINI_API_KEY" not in os.environ:
+            parser.error("環境変数 GEMINI_API_KEY が設定されていません（--fake でAPIを使わずに実行できます）")
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+        model_names = [name.strip() for name in args.models.split(",") if name.strip()]
+        if len(model_names) == 1:
+            return create_model(model_names[0], context_cache=args.context_cache)
+        return ModelPool(
+            [(name, create_model(name, context_cache=args.context_cache)) for name in model_names],
+            hedge_after=args.hedge_after,
+            # Hedges and failovers count against --rpm / --tpm too
+            rate_limiter=rate_limiter,
+            system_tokens=estimate_tokens(get_system_prompt())
+        )
+
+    backend = "synthetic" if args.fake else "replay" if args.replay else "record" if args.record else "live"
+    model = create_backend(
+        backend,
+        create_live_model,
+        args.replay or args.record,
+        latency=args.fake_latency,
+        error_rates={"quota": args.fake_quota_error_rate}
+    )
+    # The cache key names the primary model
+    model_name = model.model_name if backend in ("synthetic", "replay") else args.models.split(",")[0].strip()
+
+    cache = None if args.no_cache else ResponseCache(args.data_dir)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    started_at = time.perf_counter()
+    try:
+        counts = run_batch(
+            read_memos(args.input),
+            out,
+            model,
+            rate_limiter,
+            workers=args.workers,
+            max_retries=args.max_retries,
+            long_memo_chars=args.long_memo_chars,
+            metrics_log=MetricsLog(args.data_dir),
+            model_name=model_name,
+            cache=cache
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started_at
+    print(f"完了: 成功 {counts['ok']} 件 / 一部失敗 {counts['partial']} 件 / 失敗 {counts['error']} 件（{elapsed:.1f}秒）", file=sys.stderr)
+    return 1 if counts["error"] or counts["partial"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import argparse
+import random
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_model import FakeGenerativeModel, ScriptedModel
+from long_memo import process_long_memo
+from memo_pipeline import process_memo
+from metrics import classify_error, percentile
+from model_pool import ModelPool
+from scheduler import ScheduledModel, Scheduler
+from postprocess import extract_unconfirmed_items, get_name_index, remove_placeholder_names
+from tests.legacy_postprocess import SIZES, legacy_extract_unconfirmed_items, legacy_remove_placeholder_names, make_memo
+
+
+def timed(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def bench_postprocess(args):
+    """後処理（未確認抽出＋人名置換）の新旧実装を比較する"""
+    for label in args.sizes.split(","):
+        memo, output = make_memo(SIZES[label])
+
+        def legacy():
+            text, items = legacy_extract_unconfirmed_items(output)
+            return legacy_remove_placeholder_names(text, memo), items
+
+        def current():
+            # Measure index construction too, not just a cached lookup
+            get_name_index.cache_clear()
+            text, items = extract_unconfirmed_items(output)
+            return remove_placeholder_names(text, memo), items
+
+        expected, legacy_time = timed(legacy, repeat=args.repeat)
+        actual, current_time = timed(current, repeat=args.repeat)
+        if actual != expected:
+            print(f"{label}: 出力が最適化前の実装と一致しません", file=sys.stderr)
+            return 1
+        print(f"{label:>5}: 最適化前 {legacy_time * 1000:9.1f} ms / 現在 {current_time * 1000:9.1f} ms（{legacy_time / current_time:.1f}倍）")
+    return 0
+
+
+def bench_chunked(args):
+    """長いメモの1回呼び出しと分割並列処理（map-reduce）をテスト用モデルで比較する"""
+    for label in args.sizes.split(","):
+        memo, _ = make_memo(SIZES[label])
+        model = FakeGenerativeModel(latency=args.latency, latency_per_char=args.latency_per_char)
+        single, single_time = timed(process_memo, model, memo, repeat=args.repeat)
+        chunked, chunked_time = timed(
+            lambda: process_long_memo(model, memo, max_chunk_chars=args.chunk_chars, workers=args.workers),
+            repeat=args.repeat
+        )
+        # The fake model keeps at most ten details per call, so chunking also covers more of the memo
+        details = [result["output"].count("\n- ") for result in (single, chunked)]
+        print(
+            f"{label:>5}: 1回呼び出し {single_time:6.2f} 秒 / 分割並列 {chunked_time:6.2f} 秒"
+            f"（{chunked['chunks']}分割, {single_time / chunked_time:.1f}倍, 詳細 {details[0]} → {details[1]} 行）"
+        )
+    return 0
+
+
+def run_requests(model, count, workers):
+    """count 件のメモを workers 並列で処理し、(各件の所要時間, エラー数) を返す"""
+    def one(i):
+        started_at = time.perf_counter()
+        try:
+            process_memo(model, f"{i}件目のメモ。終身保険について話した。")
+        except Exception:
+            return None
+        return time.perf_counter() - started_at
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(one, range(count)))
+    latencies = sorted(latency for latency in results if latency is not None)
+    return latencies, count - len(latencies)
+
+
+def bench_pool(args):
+    """モデルプール（ヘッジ・ブレーカー）の効果を、台本どおりに動くモデルで確認する"""
+    rng = random.Random(0)
+
+    def primary_script():
+        return [(args.slow_latency if rng.random() < args.slow_rate else args.latency, "ok") for _ in range(args.requests)]
+
+    def summary(latencies, errors):
+        return (
+            f"p50 {percentile(latencies, 50):5.2f}秒 / p95 {percentile(latencies, 95):5.2f}秒"
+            f" / p99 {percentile(latencies, 99):5.2f}秒（失敗 {errors} 件）"
+        )
+
+    print(f"遅い応答（{args.slow_rate:.0%} が {args.slow_latency}秒）:")
+    script = primary_script()
+    print("  単一モデル     " + summary(*run_requests(ScriptedModel(script), args.requests, args.workers)))
+    pool = ModelPool(
+        [("primary", ScriptedModel(script)), ("secondary", ScriptedModel([(args.secondary_latency, "ok")]))],
+        hedge_after=args.slow_latency / 2,
+        min_samples=20
+    )
+    print("  プール（ヘッジ） " + summary(*run_requests(pool, args.requests, args.workers)) + f" ヘッジ {pool.hedges} 回")
+
+    print("クォータ超過（primary が常に429）:")
+    for label, threshold in (("ブレーカーなし", args.requests + 1), ("ブレーカーあり", 2)):
+        primary = ScriptedModel([(args.latency, "quota")])
+        pool = ModelPool(
+            [("primary", primary), ("secondary", ScriptedModel([(args.secondary_latency, "ok")]))],
+            hedge_after=None,
+            failure_threshold=threshold
+        )
+        latencies, errors = run_requests(pool, args.requests, args.workers)
+        print(f"  {label}  " + summary(latencies, errors) + f" primary への送信 {primary.calls} 回")
+    return 0
+
+
+class CountingModel:
+    """送信結果を数えるラッパー（API側から見たクォータエラーの件数を出すため）"""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+        self.quota_errors = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        try:
+            return self.model.generate_content(*args, **kwargs)
+        except Exception as e:
+            if classify_error(e) == "quota":
+                with self._lock:
+                    self.quota_errors += 1
+            raise
+
+
+def bench_scheduler(args):
+    """クォータのあるテスト用モデルに複数セッションから送り、直接送信とスケジューラー経由を比較する"""
+    rng = random.Random(0)
+    # Some sessions send the same memo at the same moment (e.g. a shared transcript)
+    memos = [
+        [f"{i}件目の共有メモ。終身保険について話した。" if rng.random() < args.duplicate_rate else f"{session}-{i}件目のメモ。年金について話した。" for i in range(args.requests)]
+        for session in range(args.sessions)
+    ]
+
+    def run(label, send):
+        model = CountingModel(FakeGenerativeModel(latency=args.latency, quota=(args.quota, args.window)))
+        latencies = []
+        start_barrier = threading.Barrier(args.sessions)
+
+        def session_loop(session):
+            start_barrier.wait()
+            for memo in memos[session]:
+                started_at = time.perf_counter()
+                send(model, session, memo)
+                latencies.append(time.perf_counter() - started_at)
+
+        started_at = time.perf_counter()
+        threads = [threading.Thread(target=session_loop, args=(session,)) for session in range(args.sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+        latencies.sort()
+        print(
+            f"  {label} {len(latencies) / elapsed:5.2f} 件/秒 / p50 {percentile(latencies, 50):5.2f}秒 / p95 {percentile(latencies, 95):5.2f}秒"
+            f" / API送信 {model.calls} 回（クォータエラー {model.quota_errors} 回）"
+        )
+
+    def direct(model, session, memo):
+        # What each session does on its own: retry the 429 after a backoff
+        for attempt in range(args.max_retries + 1):
+            try:
+                return process_memo(model, memo)
+            except Exception as e:
+                if classify_error(e) != "quota" or attempt == args.max_retries:
+                    raise
+                time.sleep(args.window / args.quota * 2 ** attempt * (1 + rng.random()))
+
+    scheduler = Scheduler(args.quota, max_concurrent=args.concurrency, period=args.window)
+
+    def scheduled(model, session, memo):
+        return process_memo(ScheduledModel(scheduler, model, session, poll_interval=0.05), memo)
+
+    print(
+        f"{args.sessions} セッション × {args.requests} 件（クォータ {args.quota} 件/{args.window}秒,"
+        f" 応答 {args.latency}秒, 同じメモ {args.duplicate_rate:.0%}）:"
+    )
+    run("直接送信（429で再試行）", direct)
+    run("スケジューラー経由    ", scheduled)
+    status = scheduler.status()
+    print(f"  スケジューラー: 送信 {status['sent']} 件 / 相乗り {status['shared']} 件 / 再送 {status['retried']} 件")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成データでの性能計測")
+    subparsers = parser.add_subparsers(dest="target", required=True)
+    postprocess_parser = subparsers.add_parser("postprocess", help="後処理の新旧比較（出力一致も確認）")
+    postprocess_parser.add_argument("--sizes", default="10k,100k,1m", help="メモの大きさ（10k, 100k, 1m）")
+    postprocess_parser.add_argument("--repeat", type=int, default=3, help="計測回数（最小値を表示）")
+    postprocess_parser.set_defaults(func=bench_postprocess)
+    chunked_parser = subparsers.add_parser("chunked", help="長いメモの1回呼び出しと分割並列処理の比較（テスト用モデル）")
+    chunked_parser.add_argument("--sizes", default="10k,100k", help="メモの大きさ（10k, 100k, 1m）")
+    chunked_parser.add_argument("--repeat", type=int, default=1, help="計測回数（最小値を表示）")
+    chunked_parser.add_argument("--latency", type=float, default=0.5, help="テスト用モデルの1回あたりの応答時間（秒）")
+    chunked_parser.add_argument("--latency-per-char", type=float, default=0.00005, help="入力1文字あたりの追加の応答時間（秒）")
+    chunked_parser.add_argument("--chunk-chars", type=int, default=6000, help="1チャンクの最大文字数")
+    chunked_parser.add_argument("--workers", type=int, default=4, help="分割処理の同時実行数")
+    chunked_parser.set_defaults(func=bench_chunked)
+    pool_parser = subparsers.add_parser("pool", help="モデルプールのヘッジ・ブレーカーの効果（台本どおりのモデル）")
+    pool_parser.add_argument("--requests", type=int, default=200, help="リクエスト数")
+    pool_parser.add_argument("--workers", type=int, default=8, help="同時実行数")
+    pool_parser.add_argument("--latency", type=float, default=0.1, help="primary の通常の応答時間（秒）")
+    pool_parser.add_argument("--slow-latency", type=float, default=1.0, help="primary の遅い応答の時間（秒）")
+    pool_parser.add_argument("--slow-rate", type=float, default=0.05, help="primary が遅い応答を返す割合")
+    pool_parser.add_argument("--secondary-latency", type=float, default=0.15, help="secondary の応答時間（秒）")
+    pool_parser.set_defaults(func=bench_pool)
+    scheduler_parser = subparsers.add_parser("scheduler", help="複数セッションからの送信を直接とスケジューラー経由で比較（クォータ付きテスト用モデル）")
+    scheduler_parser.add_argument("--sessions", type=int, default=8, help="同時セッション数")
+    scheduler_parser.add_argument("--requests", type=int, default=6, help="1セッションあたりのリクエスト数")
+    scheduler_parser.add_argument("--quota", type=int, default=10, help="window 秒あたりに通るリクエスト数")
+    scheduler_parser.add_argument("--window", type=float, default=2.0, help="クォータの区間（秒。実際の1分を縮めたもの）")
+    scheduler_parser.add_argument("--latency", type=float, default=0.2, help="テスト用モデルの応答時間（秒）")
+    scheduler_parser.add_argument("--duplicate-rate", type=float, default=0.25, help="セッション間で同じメモを送る割合")
+    scheduler_parser.add_argument("--concurrency", type=int, default=4, help="スケジューラーの同時送信数")
+    scheduler_parser.add_argument("--max-retries", type=int, default=8, help="直接送信で429を再試行する回数")
+    scheduler_parser.set_defaults(func=bench_scheduler)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
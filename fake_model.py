@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from google.api_core import exceptions as api_exceptions
+
+from rate_limit import SlidingWindow
+
+
+# Errors that can be injected, keyed by the error class used in the metrics
+INJECTED_ERRORS = {
+    "quota": lambda: api_exceptions.ResourceExhausted("429 Resource has been exhausted (e.g. check quota)."),
+    "timeout": lambda: api_exceptions.DeadlineExceeded("504 Deadline Exceeded"),
+    "connection": lambda: api_exceptions.ServiceUnavailable("503 failed to connect to all addresses")
+}
+
+
+BACKENDS = ["live", "record", "replay", "synthetic"]
+
+
+def prompt_hash(contents):
+    """記録の検索キー（送信したユーザープロンプトのハッシュ）"""
+    return hashlib.sha256(contents.encode("utf-8")).hexdigest()
+
+
+class MissingRecordingError(LookupError):
+    """再生モードで、プロンプトに対応する記録が無い"""
+
+
+class FakeResponse:
+    """generate_content の応答を模したオブジェクト"""
+
+    def __init__(self, text, prompt_token_count=0, candidates_token_count=None):
+        self.text = text
+        self.parts = [text] if text else []
+        # Streamed chunks report the running total, like the real API
+        candidates_token_count = len(text) if candidates_token_count is None else candidates_token_count
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_token_count,
+            candidates_token_count=candidates_token_count,
+            total_token_count=prompt_token_count + candidates_token_count
+        )
+
+
+class FakeGenerativeModel:
+    """ネットワークを使わずに■形式の出力を返すテスト用モデル"""
+
+    def __init__(self, model_name="fake", latency=0.0, quota_error_rate=0.0, chunk_size=20, seed=None, latency_per_char=0.0, error_rates=None, quota=None):
+        self.model_name = model_name
+        self.cached_content = None
+        self.latency = latency
+        # Added per prompt character, so long prompts take longer like the real API
+        self.latency_per_char = latency_per_char
+        # Probability of each injected error class (see INJECTED_ERRORS)
+        self.error_rates = {"quota": quota_error_rate, **(error_rates or {})}
+        # (requests, seconds): requests beyond this many per window get a 429, like the real per-key quota
+        self._quota = SlidingWindow(*quota) if quota else None
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            error_class = next((name for name, rate in self.error_rates.items() if self._random.random() < rate), None)
+            if self._quota is not None and error_class is None:
+                now = time.monotonic()
+                if self._quota.wait_time(1, now) > 0:
+                    error_class = "quota"
+                else:
+                    self._quota.take(1, now)
+        if error_class is not None:
+            raise INJECTED_ERRORS[error_class]()
+        text = self.render(contents)
+        latency = self.latency + self.latency_per_char * len(contents)
+        if stream:
+            return self._stream(text, len(contents), latency)
+        time.sleep(latency)
+        return FakeResponse(text, len(contents))
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=len(contents))
+
+    def render(self, prompt):
+        """プロンプト末尾のメモから■形式の出力を組み立てる"""
+        memo = prompt.rsplit("\n\n", 1)[-1]
+        sentences = [s.strip() for s in re.split(r'[。\n]', memo) if s.strip()]
+        details = "\n".join(f"- {s}" for s in sentences[:10]) or "- なし"
+        return (
+            "■面談概要\n\n"
+            f"{sentences[0] if sentences else '面談を行った'}。\n\n"
+            "■詳細内容\n\n"
+            f"{details}\n\n"
+            "--------------------------------------------------\n"
+            "⚠️ **未確認**: 面談日時・形式, ToDo\n"
+            "--------------------------------------------------\n"
+        )
+
+    def _stream(self, text, prompt_token_count, latency):
+        # The total latency is spread over the chunks; the first arrives early
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        sent = 0
+        for chunk in chunks:
+            time.sleep(latency / max(len(chunks), 1))
+            sent += len(chunk)
+            yield FakeResponse(chunk, prompt_token_count, sent)
+
+
+class ReplayModel(FakeGenerativeModel):
+    """記録した応答をオフラインで返すモデル（遅延・エラーの注入はテスト用モデルと同じ）"""
+
+    def __init__(self, directory, synthetic_fallback=False, **kwargs):
+        super().__init__(**{"model_name": "replay", **kwargs})
+        self.directory = directory
+        self.synthetic_fallback = synthetic_fallback
+
+    def render(self, prompt):
+        path = os.path.join(self.directory, prompt_hash(prompt) + ".json")
+        if not os.path.exists(path):
+            if self.synthetic_fallback:
+                return super().render(prompt)
+            raise MissingRecordingError(f"プロンプトに対応する記録がありません: {os.path.basename(path)}")
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["text"]
+
+
+class RecordingModel:
+    """実際のモデルへの呼び出しを中継し、応答をプロンプトのハッシュごとに保存する"""
+
+    def __init__(self, model, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.model = model
+        self.directory = directory
+
+    def __getattr__(self, name):
+        # model_name, cached_content, count_tokens and so on come from the real model
+        return getattr(self.model, name)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        response = self.model.generate_content(contents, generation_config=generation_config, stream=stream, **kwargs)
+        if stream:
+            return self._record_stream(contents, response)
+        self.save(contents, response.text)
+        return response
+
+    def _record_stream(self, contents, response):
+        texts = []
+        for chunk in response:
+            if chunk.parts:
+                texts.append(chunk.text)
+            yield chunk
+        # Only responses that were received completely are saved
+        self.save(contents, "".join(texts))
+
+    def save(self, contents, text):
+        """応答を1件保存する（同じプロンプトは上書き）"""
+        path = os.path.join(self.directory, prompt_hash(contents) + ".json")
+        record = {
+            "model": getattr(self.model, "model_name", None),
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "prompt": contents,
+            "text": text
+        }
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+
+class ScriptedModel(FakeGenerativeModel):
+    """呼び出しごとの応答時間と結果を台本どおりに返すモデル（モデルプールの確認用）
+
+    script: (秒, 結果) の列。結果は "ok" または INJECTED_ERRORS のキー。最後まで使うと先頭に戻る。"""
+
+    def __init__(self, script, **kwargs):
+        super().__init__(**kwargs)
+        self.script = list(script)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        with self._lock:
+            latency, outcome = self.script[self.calls % len(self.script)]
+            self.calls += 1
+        if outcome != "ok":
+            time.sleep(latency)
+            raise INJECTED_ERRORS[outcome]()
+        text = self.render(contents)
+        if stream:
+            return self._stream(text, len(contents), latency)
+        time.sleep(latency)
+        return FakeResponse(text, len(contents))
+
+
+def create_backend(backend, live_model_factory=None, recordings_dir="data/recordings", latency=0.0, error_rates=None, seed=None):
+    """モデルのバックエンドを作る（live: 実API, record: 実APIの応答を記録, replay: 記録を再生, synthetic: 合成出力）"""
+    if backend not in BACKENDS:
+        raise ValueError(f"不明なバックエンドです: {backend}")
+    if backend == "synthetic":
+        return FakeGenerativeModel(latency=latency, error_rates=error_rates, seed=seed)
+    if backend == "replay":
+        return ReplayModel(recordings_dir, latency=latency, error_rates=error_rates, seed=seed)
+    model = live_model_factory()
+    if backend == "record":
+        return RecordingModel(model, recordings_dir)
+    return model
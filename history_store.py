@@ -0,0 +1,168 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+DATE_QUERY_PATTERN = re.compile(r'(\d{4})[-/年](\d{1,2})(?:月|[-/](?=\d))?(?:(\d{1,2})日?)?')
+# The trigram tokenizer cannot match terms shorter than three characters;
+# shorter terms (田中, 日生, 年金 ...) use a separate index of single
+# characters and character bigrams
+FTS_MIN_TERM_LENGTH = 3
+# Characters the ascii tokenizer treats as separators; grams containing them
+# are not indexed, and terms containing them fall back to LIKE
+ASCII_SEPARATOR_PATTERN = re.compile(r'[^0-9A-Za-z\x80-\U0010ffff]')
+
+
+def short_grams(text):
+    """本文の1文字・2文字の索引語を空白区切りで返す（記号・空白を含むものは除く）"""
+    grams = set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+    return " ".join(sorted(gram for gram in grams if not ASCII_SEPARATOR_PATTERN.search(gram)))
+
+
+class HistoryStore:
+    """生成履歴のSQLiteストア（FTS5全文検索・ページング）
+
+    履歴は owner（利用者ごとのキー）単位で分かれ、一覧・取得・削除は同じ owner の履歴だけが対象になる。"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "history.sqlite3")
+        self._lock = threading.Lock()
+        # Streamlit sessions run in separate threads and share this instance
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                input TEXT NOT NULL,
+                output TEXT NOT NULL,
+                unconfirmed TEXT,
+                latency TEXT,
+                owner TEXT
+            )"""
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(history)")}
+        if "owner" not in columns:
+            # Rows written before history was scoped have no owner and are not listed
+            self._conn.execute("ALTER TABLE history ADD COLUMN owner TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_owner ON history (owner, id)")
+        try:
+            # Japanese has no word boundaries, so index character trigrams
+            self._conn.execute(
+                """CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                    input, output, content='history', content_rowid='id', tokenize='trigram'
+                )"""
+            )
+            self._conn.executescript(
+                """CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+                    INSERT INTO history_fts (rowid, input, output) VALUES (new.id, new.input, new.output);
+                END;
+                CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN
+                    INSERT INTO history_fts (history_fts, rowid, input, output) VALUES ('delete', old.id, old.input, old.output);
+                END;"""
+            )
+            # Contentless: only the row IDs are needed, and the grams are
+            # recomputed from the row when it is deleted
+            has_short_grams = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_short'").fetchone()
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS history_short USING fts5(grams, content='', tokenize='ascii')"
+            )
+            if not has_short_grams:
+                # Rows stored before the short-term index existed
+                for row in self._conn.execute("SELECT id, input, output FROM history").fetchall():
+                    self._index_short_grams(row)
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            # SQLite builds without FTS5/trigram fall back to LIKE scans
+            self.full_text_search = False
+        self._conn.commit()
+
+    def add(self, entry, owner):
+        """owner の履歴を1件追加し、そのIDを返す"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO history (timestamp, input, output, unconfirmed, latency, owner) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    entry["input"],
+                    entry["output"],
+                    entry.get("unconfirmed"),
+                    json.dumps(entry["latency"]) if entry.get("latency") else None,
+                    owner
+                )
+            )
+            if self.full_text_search:
+                self._index_short_grams({"id": cursor.lastrowid, "input": entry["input"], "output": entry["output"]})
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def get(self, entry_id, owner):
+        """owner の履歴を1件取得する（無い場合は None）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM history WHERE id = ? AND owner = ?", (entry_id, owner)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["latency"] = json.loads(entry["latency"]) if entry["latency"] else None
+        return entry
+
+    def search(self, owner, query="", offset=0, limit=10):
+        """owner の履歴のうち検索条件に合うものの一覧（本文を含まない要約）と総件数を返す（新しい順）"""
+        where, params = self._build_filter(query)
+        where, params = f"owner = ? AND {where}", [owner, *params]
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM history WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"""SELECT id, timestamp, substr(input, 1, 60) AS preview, unconfirmed
+                FROM history WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?""",
+                (*params, limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def clear(self, owner):
+        """owner の履歴をすべて削除する（3文字以上の全文検索の索引はトリガーで更新される）"""
+        with self._lock:
+            if self.full_text_search:
+                for row in self._conn.execute("SELECT id, input, output FROM history WHERE owner = ?", (owner,)).fetchall():
+                    self._index_short_grams(row, delete=True)
+            self._conn.execute("DELETE FROM history WHERE owner = ?", (owner,))
+            self._conn.commit()
+
+    def _build_filter(self, query):
+        """検索語を WHERE 句に変換する（各語のAND。日付は作成日か本文、その他は入力・出力の全文検索）"""
+        clauses = []
+        params = []
+        for term in query.split():
+            text_clause, text_params = self._text_clause(term)
+            date_match = DATE_QUERY_PATTERN.fullmatch(term)
+            if date_match:
+                year, month, day = date_match.groups()
+                prefix = f"{year}-{int(month):02d}" + (f"-{int(day):02d}" if day else "")
+                clauses.append(f"(timestamp LIKE ? OR {text_clause})")
+                params.extend([prefix + "%", *text_params])
+            else:
+                clauses.append(text_clause)
+                params.extend(text_params)
+        return " AND ".join(clauses) or "1", params
+
+    def _index_short_grams(self, row, delete=False):
+        # A contentless table deletes a row by being given the same values again
+        grams = short_grams(row["input"] + "\n" + row["output"])
+        if delete:
+            self._conn.execute("INSERT INTO history_short (history_short, rowid, grams) VALUES ('delete', ?, ?)", (row["id"], grams))
+        else:
+            self._conn.execute("INSERT INTO history_short (rowid, grams) VALUES (?, ?)", (row["id"], grams))
+
+    def _text_clause(self, term):
+        if self.full_text_search and len(term) >= FTS_MIN_TERM_LENGTH:
+            return "id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)", ['"' + term.replace('"', '""') + '"']
+        if self.full_text_search and not ASCII_SEPARATOR_PATTERN.search(term):
+            return "id IN (SELECT rowid FROM history_short WHERE history_short MATCH ?)", ['"' + term + '"']
+        # % and _ in the term are matched literally
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return "(input LIKE ? ESCAPE '\\' OR output LIKE ? ESCAPE '\\')", [pattern] * 2
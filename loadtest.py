@@ -0,0 +1,182 @@
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from batch import read_memos
+from metrics import percentile
+from tests.legacy_postprocess import make_memo
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+# The harness patches Streamlit internals (ScriptCache, Runtime._instance,
+# Secrets._secrets, AppTest's session state) that change between releases;
+# it is verified only on this version, which requirements-dev.txt pins
+VERIFIED_STREAMLIT_VERSION = "1.65.0"
+
+
+def session_state_bytes(app_test):
+    """セッションの状態（st.session_state）のおおよそのサイズ（pickle後のバイト数）"""
+    # The public proxy has no way to list keys; filtered_state leaves out Streamlit internals
+    state = app_test._session_state.filtered_state
+    return sum(len(pickle.dumps(value)) for value in state.values())
+
+
+def run_user(user, memos, iterations, timeout, results, start_barrier):
+    """1人分のセッションで「メモを整理」を iterations 回繰り返す"""
+    from streamlit.testing.v1 import AppTest
+
+    try:
+        app_test = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        app_test.run()
+        sizes = [session_state_bytes(app_test)]
+    except BaseException:
+        # Release the other sessions instead of leaving them waiting forever
+        start_barrier.abort()
+        raise
+    start_barrier.wait()
+    for iteration in range(iterations):
+        memo = memos[(user * iterations + iteration) % len(memos)]
+        started_at = time.perf_counter()
+        try:
+            app_test.text_area[0].input(memo)
+            app_test.button[0].click().run()
+            errors = [element.value for element in (*app_test.exception, *app_test.error)]
+            status = "error" if errors else "ok"
+        except Exception as e:
+            # A rerun that exceeds the timeout, or a page left without its
+            # widgets by a failed rerun; start the session over
+            status = type(e).__name__
+            app_test.run()
+        results.append({"user": user, "status": status, "latency": time.perf_counter() - started_at})
+        sizes.append(session_state_bytes(app_test))
+    results.append({"user": user, "session_state": sizes})
+
+
+def load_memos(path, count, unique):
+    memos = [text for _, text in read_memos(path)] if path else [make_memo(600, seed)[0] for seed in range(count)]
+    if unique:
+        # A distinct line per request keeps the response cache from serving repeats
+        memos = [f"{memo}\n（負荷試験 {i}）" for i, memo in enumerate(memos * (count // len(memos) + 1))][:count]
+    return memos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数の同時セッションでアプリに負荷をかけ、スループット・遅延・メモリ増加を計測する")
+    parser.add_argument("--users", type=int, default=8, help="同時セッション数")
+    parser.add_argument("--iterations", type=int, default=5, help="1セッションあたりの「メモを整理」の回数")
+    parser.add_argument("--backend", choices=["synthetic", "replay"], default="synthetic", help="モデルのバックエンド（APIは呼ばない）")
+    parser.add_argument("--recordings-dir", default="data/recordings", help="replay で使う記録のディレクトリ")
+    parser.add_argument("--memos", help="送信するメモ（ディレクトリまたはJSONL。省略時は合成メモ）")
+    parser.add_argument("--latency", type=float, default=1.0, help="モデルの応答時間（秒）")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="CLASS=RATE", help="注入するエラー（例: quota=0.05, timeout=0.01）")
+    parser.add_argument("--rpm", type=int, default=100000, help="スケジューラーの1分あたりのリクエスト数の上限（テスト用モデルにクォータは無いため既定は実質無制限）")
+    parser.add_argument("--concurrency", type=int, help="スケジューラーの同時送信数（省略時はセッション数）")
+    parser.add_argument("--allow-cache-hits", action="store_true", help="同じメモを繰り返し送る（応答キャッシュを効かせる）")
+    parser.add_argument("--timeout", type=float, default=120, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc でプロセスのメモリ増加も計測する（遅延が大きくなる）")
+    args = parser.parse_args(argv)
+
+    import streamlit as st
+    if st.__version__ != VERIFIED_STREAMLIT_VERSION:
+        print(
+            f"この負荷試験は Streamlit {VERIFIED_STREAMLIT_VERSION} でのみ確認しています（インストール済み: {st.__version__}）。"
+            "pip install -r requirements-dev.txt で揃えてください",
+            file=sys.stderr
+        )
+        return 2
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    # A server compiles the script once for all sessions, but AppTest compiles
+    # it on every run; concurrent compiles trip a CPython parser bug, so share
+    # one cache like the server does
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+    # AppTest installs a mock runtime before each run and removes it after;
+    # with concurrent sessions the removal pulls it from under runs still in
+    # progress, so only the installs are passed on to the real Runtime
+    class KeepRuntimeInstance(type):
+        def __setattr__(cls, name, value):
+            if name == "_instance":
+                if value is not None:
+                    Runtime._instance = value
+                return
+            super().__setattr__(name, value)
+
+    class SharedRuntime(Runtime, metaclass=KeepRuntimeInstance):
+        pass
+
+    app_test.Runtime = SharedRuntime
+
+    data_dir = tempfile.mkdtemp(prefix="nippotool-loadtest-")
+    # AppTest swaps the global st.secrets per run, which races between
+    # concurrent sessions; set them once globally instead
+    secrets = Secrets()
+    secrets._secrets = {
+        "MODEL_BACKEND": args.backend,
+        "RECORDINGS_DIR": args.recordings_dir,
+        "DATA_DIR": data_dir,
+        "FAKE_LATENCY": args.latency,
+        "FAKE_ERROR_RATES": {name: float(rate) for name, rate in (item.split("=") for item in args.error_rate)},
+        "SCHEDULER_RPM": args.rpm,
+        "SCHEDULER_TPM": 0,
+        "SCHEDULER_CONCURRENCY": args.concurrency or args.users
+    }
+    st.secrets = secrets
+
+    memos = load_memos(args.memos, args.users * args.iterations, not args.allow_cache_hits)
+    results = []
+    start_barrier = threading.Barrier(args.users + 1)
+    if args.trace_memory:
+        tracemalloc.start()
+    threads = [
+        threading.Thread(target=run_user, args=(user, memos, args.iterations, args.timeout, results, start_barrier))
+        for user in range(args.users)
+    ]
+    for thread in threads:
+        thread.start()
+    # Sessions are warmed up (first run, cached resources) before timing starts
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        print("セッションの起動に失敗しました", file=sys.stderr)
+        return 1
+    memory_before = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    memory_after, memory_peak = tracemalloc.get_traced_memory() if args.trace_memory else (0, 0)
+    tracemalloc.stop()
+
+    requests = [result for result in results if "latency" in result]
+    latencies = sorted(result["latency"] for result in requests)
+    statuses = Counter(result["status"] for result in requests)
+    growth = [result["session_state"][-1] - result["session_state"][1] for result in results if "session_state" in result]
+    print(f"セッション {args.users} × {args.iterations} 回（{args.backend}, 応答時間 {args.latency:.2f}秒）")
+    print(f"スループット: {len(requests) / elapsed:.2f} 件/秒（{len(requests)} 件 / {elapsed:.1f}秒）")
+    print(
+        f"遅延: p50 {percentile(latencies, 50):.2f}秒 / p95 {percentile(latencies, 95):.2f}秒"
+        f" / p99 {percentile(latencies, 99):.2f}秒 / 最大 {latencies[-1]:.2f}秒"
+    )
+    print("結果: " + ", ".join(f"{status} {count} 件" for status, count in statuses.most_common()))
+    # Growth is measured from the end of the first request, so widget state set up on first use is not counted
+    print(
+        f"セッション状態の増加（2回目以降）: 平均 {sum(growth) / len(growth):,.0f} バイト / 最大 {max(growth):,} バイト"
+        f" / 1回あたり {max(growth) / max(args.iterations - 1, 1):,.0f} バイト"
+    )
+    if args.trace_memory:
+        print(f"プロセスのメモリ（tracemalloc）: {(memory_after - memory_before) / 1024:,.0f} KiB 増加 / ピーク {memory_peak / 1024:,.0f} KiB")
+    return 0 if statuses.get("ok", 0) == len(requests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from memo_pipeline import MODEL_NAME, PROMPT_VERSION, TEMPERATURE, get_system_prompt, normalizer
+from metrics import classify_error, usage_counts
+from postprocess import SEPARATOR_LINE_PATTERN, UNCONFIRMED_LINE_PATTERN, extract_unconfirmed_items, remove_placeholder_names
+from rate_limit import estimate_tokens
+from response_cache import make_cache_key
+
+# Memos longer than this are processed in chunks; chunks are packed up to
+# MAX_CHUNK_CHARS characters, split at natural boundaries
+LONG_MEMO_CHARS = 12000
+MAX_CHUNK_CHARS = 6000
+BOUNDARY_PATTERNS = [re.compile(r'\n\s*\n'), re.compile(r'\n'), re.compile(r'(?<=[。！？!?])')]
+
+CHUNK_PROMPT_TEMPLATE = "以下は長いメモを分割したうちの一部（{index}/{total}）です。この部分に含まれる情報だけを整理し、指定の出力フォーマットで出力してください。\n※この部分に情報が無い項目は省略し、「⚠️ 未確認」の行は出力しないこと。\n※現在の西暦は {current_year} 年です。年が指定されていない日付は必ず「{current_year}年」で補完すること。\n※入力に人名が含まれていない場合、タカシさん等の架空の名前は絶対に出力しないこと。\n\n"
+
+# Output sections in order, with the item names used for the 未確認 warning
+SECTIONS = ["面談日時・形式", "面談概要", "詳細内容", "決定事項・今後の予定", "ToDo"]
+REQUIRED_SECTIONS = {"面談日時・形式": "面談日時・形式", "決定事項・今後の予定": "決定事項・次回の予定", "ToDo": "ToDo"}
+SECTION_HEADER_PATTERN = re.compile(r'■\s*(.+?)\s*$')
+BULLET_PATTERN = re.compile(r'^(?:[-・*●]|\d+[.)．])\s*')
+DEDUP_STRIP_PATTERN = re.compile(r'[\s、。,.・「」（）()]')
+
+
+def split_memo(text, max_chars=MAX_CHUNK_CHARS):
+    """メモを段落・行・文の区切りで max_chars 以下のチャンクに分割する"""
+    pieces = [text]
+    for boundary in BOUNDARY_PATTERNS:
+        pieces = [part for piece in pieces for part in (boundary.split(piece) if len(piece) > max_chars else [piece])]
+    # A single sentence longer than max_chars is cut as a last resort
+    pieces = [piece[i:i + max_chars] for piece in pieces for i in range(0, max(len(piece), 1), max_chars)]
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if not piece.strip():
+            continue
+        if current and len(current) + len(piece) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def parse_sections(text):
+    """■見出しごとに本文の行を集める（区切り線・未確認行は除く）"""
+    sections = {}
+    current = None
+    for line in text.split("\n"):
+        stripped = line.strip()
+        header = SECTION_HEADER_PATTERN.match(stripped)
+        if header:
+            # Headers such as "ToDo（当方タスク）" map to the canonical section
+            current = next((name for name in SECTIONS if header.group(1).startswith(name)), None)
+            if current:
+                sections.setdefault(current, [])
+            continue
+        if current is None or not stripped or stripped.startswith("※"):
+            continue
+        if SEPARATOR_LINE_PATTERN.fullmatch(stripped) or UNCONFIRMED_LINE_PATTERN.match(stripped):
+            continue
+        sections[current].append(stripped)
+    return sections
+
+
+def merge_sections(partials):
+    """部分出力を1つの■形式にまとめる（重複行は除去）"""
+    merged = {name: [] for name in SECTIONS}
+    seen = {name: set() for name in SECTIONS}
+    for partial in partials:
+        for name, lines in parse_sections(partial).items():
+            # The meeting date/format is taken from the first chunk that has it
+            if name == "面談日時・形式" and merged[name]:
+                continue
+            for line in lines:
+                key = DEDUP_STRIP_PATTERN.sub("", BULLET_PATTERN.sub("", line))
+                if key and key not in seen[name]:
+                    seen[name].add(key)
+                    merged[name].append(line)
+
+    todo = [line for line in merged["ToDo"] if BULLET_PATTERN.sub("", line) != "なし"]
+    if merged["ToDo"]:
+        merged["ToDo"] = todo or ["なし"]
+
+    # The overviews of the parts are joined into a single paragraph
+    blocks = [f"■{name}\n\n" + ("" if name == "面談概要" else "\n").join(lines) for name, lines in merged.items() if lines]
+    text = "--------------------------------------------------\n" + "\n\n".join(blocks) + "\n"
+    missing = [label for name, label in REQUIRED_SECTIONS.items() if not merged[name]]
+    if missing:
+        text += (
+            "\n--------------------------------------------------\n"
+            f"⚠️ **未確認**: {', '.join(missing)}\n"
+            "--------------------------------------------------\n"
+        )
+    return text
+
+
+def process_long_memo(model, input_text, model_name=MODEL_NAME, cache=None, rate_limiter=None, max_chunk_chars=MAX_CHUNK_CHARS, workers=4, on_progress=None, retry=None, now=None):
+    """長いメモを分割して並列に整理し（map）、結果をまとめる（reduce）
+
+    retry(call) を指定すると各チャンクの呼び出しをそれで包む（クォータエラーの再試行など）。
+    再試行しても残ったクォータエラーは部分的な結果にせず、そのまま送出する。"""
+    now = now or datetime.now()
+    started_at = time.perf_counter()
+    normalized_text = normalizer.normalize(input_text)
+    cache_key = None
+    generated_text = None
+    if cache is not None:
+        cache_key = make_cache_key(normalized_text, PROMPT_VERSION + "-chunked", model_name, TEMPERATURE, now.date().isoformat())
+        generated_text = cache.get(cache_key)
+
+    chunks = split_memo(normalized_text, max_chunk_chars)
+    api_started_at = time.perf_counter()
+    failed_chunks = []
+    usage = usage_counts(None)
+    if generated_text is None:
+        system_tokens = estimate_tokens(get_system_prompt(now))
+
+        def extract(index, chunk):
+            prompt = CHUNK_PROMPT_TEMPLATE.format(index=index + 1, total=len(chunks), current_year=now.year) + chunk
+
+            def send():
+                # Every attempt counts against the request budget
+                if rate_limiter is not None:
+                    rate_limiter.acquire(system_tokens + estimate_tokens(prompt))
+                return model.generate_content(prompt, generation_config={"temperature": TEMPERATURE})
+
+            return retry(send) if retry is not None else send()
+
+        partials = [None] * len(chunks)
+        errors = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(extract, index, chunk): index for index, chunk in enumerate(chunks)}
+            for done, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                try:
+                    response = future.result()
+                    partials[index] = response.text
+                    # Token counts are summed over all chunks
+                    usage = {kind: count + usage_counts(response)[kind] for kind, count in usage.items()}
+                except Exception as e:
+                    # Keep what the other chunks produced instead of failing the whole memo
+                    failed_chunks.append(index + 1)
+                    errors.append(e)
+                if on_progress is not None:
+                    on_progress(done, len(chunks))
+        if len(errors) == len(chunks):
+            raise errors[0]
+        # A quota error means the whole memo should be retried later, not
+        # reported as a result with parts missing
+        quota_errors = [error for error in errors if classify_error(error) == "quota"]
+        if quota_errors:
+            raise quota_errors[0]
+
+        generated_text = merge_sections(partial for partial in partials if partial is not None)
+        if cache is not None and not failed_chunks:
+            cache.put(cache_key, generated_text)
+
+    api_finished_at = time.perf_counter()
+    cleaned_text, unconfirmed_items = extract_unconfirmed_items(generated_text)
+    extracted_at = time.perf_counter()
+    # 入力全文に無い架空の人名を顧客に置換
+    cleaned_text = remove_placeholder_names(cleaned_text, input_text)
+    if failed_chunks:
+        note = "未処理の部分（" + ", ".join(f"{index}/{len(chunks)}" for index in sorted(failed_chunks)) + "）"
+        unconfirmed_items = f"{unconfirmed_items}, {note}" if unconfirmed_items else note
+    finished_at = time.perf_counter()
+    return {
+        "output": cleaned_text,
+        "unconfirmed": unconfirmed_items,
+        "chunks": len(chunks),
+        "failed_chunks": sorted(failed_chunks),
+        "latency": {
+            "mode": "chunked",
+            "ttft": round(finished_at - started_at, 3),
+            "total": round(finished_at - started_at, 3)
+        },
+        "stages": {
+            "prompt": round(api_started_at - started_at, 4),
+            "api_total": round(api_finished_at - api_started_at, 4),
+            "extract_unconfirmed": round(extracted_at - api_finished_at, 4),
+            "remove_names": round(finished_at - extracted_at, 4)
+        },
+        "tokens": usage
+    }
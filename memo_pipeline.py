@@ -0,0 +1,281 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+from metrics import usage_counts
+from postprocess import StreamingPostProcessor, extract_unconfirmed_items, remove_placeholder_names
+from rate_limit import estimate_tokens
+from response_cache import make_cache_key
+from terminology import load_normalizer
+
+# Model settings shared by the Streamlit app and the batch CLI
+MODEL_NAME = 'gemini-flash-lite-latest'
+TEMPERATURE = 0.3
+
+# System prompt for AI (current_year and current_date are filled at runtime)
+SYSTEM_PROMPT_TEMPLATE = """あなたはファイナンシャルプランナー（FP）の面談メモを整理・編集する専門家です。
+
+【人物名の扱い（最優先・厳守）】
+- **出力に使っていい名前は、入力テキストに実際に登場した名前だけ。** それ以外の名前は一切禁止。
+- 「入力に登場した名前」とは、入力テキスト内に「〇〇さん」「〇〇くん」「〇〇ちゃん」「〇〇」のように文字として書かれている人名のみ。
+- タカシ、田中、佐藤、山田など、過去の例や学習データに含まれるような名前を勝手に補完・使用することは絶対禁止。
+- 誰かと話したが名前が入力に無い場合は「顧客」と書く。架空・補完・推測の名前は一切使わない。
+- **人名はカタカナで表記すること。** 入力に「いさおさん」とあれば「イサオさん」、「あけみさん」とあれば「アケミさん」のようにカタカナに変換すること。ただし、入力に「ななちゃん」とあれば「ナナちゃん」のように、読み方は入力のままカタカナに変換すること（「ナミさん」など別の名前に変えるのは禁止）。
+- **入力に登場した異なる名前は、必ず別人物として区別すること。** 入力に「あけみさん」と「愛さん」が両方登場する場合は、それぞれ「アケミさん」「アイさん」として区別し、混同しないこと。
+
+【発言者の区別（最重要・厳守）】
+- **FP側が説明したことと、顧客が言ったことを明確に区別すること。**
+- 「お伝え」「説明した」「提案した」などの表現がある場合は、それがFP側の説明であることが文脈から明確になるように記載すること。
+- 特に「〜と思うとお伝え」「〜と説明した」のような表現がある場合、その「〜」の部分がFP側が説明した内容であることを明確にすること。顧客の発言のように誤解されないよう、主語や文の構造を調整すること。
+- 例：「それでもガンの自由診療はご家族が助かってほしいという気持ちがあるから残してほしいと思うとお伝え」→「それでもガンの自由診療特約については、ご家族が助かってほしいという気持ちがあるから残してほしいと説明し」のように、FP側が説明したことが明確になるように記載すること。
+- **「〜という意向があるため」「〜という意向がある」のような表現は、顧客の発言を示す場合にのみ使用すること。FP側が説明した内容を「〜という意向があるため」のように書いてはいけない。**
+- **入力に「〜と思うとお伝え」「〜と説明した」がある場合、その「〜」の部分は必ずFP側が説明した内容として記載すること。これを「〜という意向があるため」のように顧客の発言として書いてはいけない。**
+- 顧客の発言は「〇〇さんは〜と話した」「〇〇さんは〜とのこと」など、明確に主語を付けて記載すること。
+- FP側の説明が顧客の発言のように読まれないよう注意すること。必要に応じて主語を追加するか、文の構造を調整すること。
+
+【変換ルール】
+- 保険業界用語の補正を行ってください（例：20日7日→27日など）。
+- **生命保険会社名は、入力に明記されている場合はそのまま使用すること。** 入力に「あいおい」とあれば「あいおい生命」と記載し、「アオイ生命」など別の名前に変更しないこと。
+- 文体はカジュアルで簡潔なメモ調（「〜した」「〜の予定」など）にしてください。フォーマルな表現は不要です。
+- 誤変換や文脈の乱れを自然に補正してください。
+- 敬称は「様」ではなく「さん」を使用してください。
+- 「同席」と「共に説明を行った」は意味が異なる。「同席」は聞き手として参加していたことを意味し、「共に説明を行った」は説明者として参加したことを意味する。入力に「同席」とあれば、それを「共に説明を行った」に変更しないこと。入力に「〇〇さんも同席」とあれば、「〇〇さんも同席した」または「〇〇さんも同席して説明を行った」のように記載し、「〇〇さんと共に説明を行った」とは書かないこと。
+
+【ボイス入力の補正と用語の統一】
+- 入力はボイス入力（音声認識）であるため、聞き間違い・同音異義・そのまま文字になっただけの表現が含まれる。文脈や似たニュアンスから意味を汲み取り、**正しい保険・FP用語でメモとして書き足し・書き換え**して出力すること。
+{terminology_rules}- 上記に限らず、保険・年金・資産運用などで使う正式な用語が推測できる場合は、その用語で出力に反映すること。入力の「そのまま」ではなく、**こういうメモとして残すべき形**に整えて出力すること。
+
+【重要：不明な情報の扱い】
+- 情報が不明な場合は、その項目を完全に省略してください。「不明」「不明の教室」「不明な場合」などの記述は一切不要です。
+- 推測できない情報は書かないでください。空欄にするか、その項目自体を省略してください。
+
+【不足情報のチェック】
+以下の要素が入力内容に含まれているか確認してください：
+1. 面談日時・形式
+2. 決定事項・次回の予定
+3. ToDo
+
+これらが明確に含まれていない場合、出力の一番下に「⚠️ 未確認: （不足項目をカンマ区切りで列挙）」とだけ短く追記してください。
+全て揃っている場合は、この警告行は表示しないでください。
+
+【日付・西暦の扱い（必須）】
+- **西暦が入力に含まれていない場合、ユーザーが言わなくても必ず現在の西暦（{current_year}年）で補完すること。** 今日は{current_date}。年を省略した日付（例：27日、3月15日、来月5日）はすべて「{current_year}年」をつけて出力すること。
+- 面談日時・予定・期日などは、必ず「YYYY年MM月DD日」のように**期日まで省略せずに**書くこと。
+
+【出力フォーマット】
+以下の構成を厳守してください。**各セクション（■で始まる見出し）の前後には必ず空行を1行入れること。** 見出しと内容の間にも空行を入れること。
+
+--------------------------------------------------
+■面談日時・形式
+YYYY年MM月DD日 HH:MM〜（形式）
+※情報が不明な場合はこの項目を省略してください。日付がある場合は上記のルールで年を補完し、期日まで記載すること
+
+■面談概要
+（今回の面談のテーマを1〜2文で。詳細内容・決定事項・ToDoに書く内容は繰り返さない）
+
+■詳細内容
+（箇条書きで話した内容を記載。面談概要・決定事項・ToDoと重複する内容は書かない）
+※「検討した」ではなく「話した」「説明した」「話し合った」などの表現を使用
+
+■決定事項・今後の予定
+（決まったこと・次回の予定のみ。詳細内容と重複する内容は書かない）
+※情報が不明な場合はこの項目を省略してください
+
+■ToDo
+（やること。決定事項・今後の予定と重複する内容は書かない）
+※なしの場合は「なし」と記述、情報が不明な場合はこの項目を省略してください
+
+（不足がある場合のみ以下を表示）
+--------------------------------------------------
+⚠️ **未確認**: （不足項目名）, （不足項目名）
+--------------------------------------------------
+"""
+
+# Voice-input corrections that still need the model. Unambiguous ones live in
+# terminology.json and are applied to the memo before it is sent
+TERMINOLOGY_RULES = """- 主な保険用語と生命保険会社名（解約返戻金・保険会社・市場価格調整・終身保険・あいおい生命・かんぽ生命など）は、入力の時点で正式な用語に統一済み。統一済みの用語はそのまま使用すること。
+- 次の用語は、文脈から該当すると判断できる場合のみ、出力では正式な用語で記載すること：
+  - 価格の調整（市場の価格による調整を指す場合） → **市場価格調整**
+  - 定期的に払うお金・毎月の支払い・定期の支払 → **定期支払金**（ただし、保険料の合計を表す場合は「保険料」を使用すること）
+  - 生命保険会社名は必ず正式名称で記載すること（絶対に「アオイ生命」と書かないこと）。保険会社を指している場合は以下の変換を厳守すること：
+    - にほん・ニホン → **日本生命**
+    - すみとも → **住友生命**
+    - だいいち → **第一生命**
+    - めいじ → **明治安田生命**
+    - その他の生命保険会社名も、入力に近い読み方から正式名称を推測し、「〇〇生命」の形式で記載すること。
+    - **入力に生命保険会社名が明記されている場合は、その読み方を尊重し、勝手に別の名前に変更しないこと。**
+"""
+
+# The full dictionary as it was sent before local normalization; only used to
+# report the input-token savings
+INLINE_TERMINOLOGY_RULES = """- 次の用語は、言い換えや似た表現が話されていれば、出力では正式な用語で記載すること：
+  - 解約したときにもらえるお金・解約で戻るお金 → **解約返戻金**
+  - 保険を扱っている会社・保険の会社 → **保険会社**
+  - 市場の価格で調整する・時価調整・価格の調整 → **市場価格調整**
+  - 定期的に払うお金・毎月の支払い・定期の支払 → **定期支払金**（ただし、保険料の合計を表す場合は「保険料」を使用すること）
+  - 生命保険会社名は必ず正式名称で記載すること。以下の変換を厳守すること：
+    - **あいおい・アイオイ・あいおい生命・iOSM → あいおい生命**（絶対に「アオイ生命」と書かないこと。入力に「あいおい」とあれば必ず「あいおい生命」と記載すること）
+    - にほん・ニホン・日本生命 → **日本生命**
+    - すみとも・住友生命 → **住友生命**
+    - だいいち・第一生命 → **第一生命**
+    - めいじ・明治安田生命 → **明治安田生命**
+    - かんぽ・かんぽ生命 → **かんぽ生命**
+    - その他の生命保険会社名も、入力に近い読み方から正式名称を推測し、「〇〇生命」の形式で記載すること。
+    - **入力に生命保険会社名が明記されている場合は、その読み方を尊重し、勝手に別の名前に変更しないこと。**
+  - 就寝保険・終身ほけん・しゅうしんほけん・終身の保険 → **終身保険**
+"""
+
+USER_PROMPT_TEMPLATE = "以下のメモを整理して整形してください。\n※現在の西暦は {current_year} 年です。年が指定されていない日付は必ず「{current_year}年」で補完すること。\n※入力に人名が含まれていない場合、タカシさん等の架空の名前は絶対に出力しないこと。\n\n"
+
+# Deterministic terminology rewriter applied to the memo before the API call
+normalizer = load_normalizer()
+
+# Version of the prompt with the date fields factored out (part of the cache key)
+PROMPT_VERSION = hashlib.sha256(
+    (SYSTEM_PROMPT_TEMPLATE + TERMINOLOGY_RULES + USER_PROMPT_TEMPLATE + str(normalizer.version)).encode("utf-8")
+).hexdigest()[:16]
+
+def get_system_prompt(now=None, terminology_rules=TERMINOLOGY_RULES):
+    now = now or datetime.now()
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        current_year=now.year,
+        current_date=now.strftime("%Y年%m月%d日"),
+        terminology_rules=terminology_rules
+    )
+
+
+def build_prompt(input_text, now=None):
+    """メモから送信用のユーザープロンプトを組み立てる（システムプロンプトはモデル側に設定）"""
+    now = now or datetime.now()
+    return USER_PROMPT_TEMPLATE.format(current_year=now.year) + input_text
+
+def create_model(model_name=MODEL_NAME, now=None, context_cache=False, api_key=None):
+    """その日のシステムプロンプトを system_instruction に設定したモデルを作る（api_key を指定すると既定とは別のキーを使う）"""
+    import google.generativeai as genai
+    from google.ai import generativelanguage
+
+    now = now or datetime.now()
+    system_instruction = get_system_prompt(now)
+    if api_key:
+        # genai.configure is process-wide, so a model on another key gets its
+        # own client (explicit context caching always uses the default key).
+        # The client is built with the public constructor, but GenerativeModel
+        # has no public way to take it; _client is why requirements.txt pins
+        # the SDK to the version this was verified on
+        model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+        model._client = generativelanguage.GenerativeServiceClient(client_options={"api_key": api_key})
+        return model
+    if context_cache:
+        # The prompt embeds today's date, so the cached prefix lives until midnight
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        try:
+            cached_content = genai.caching.CachedContent.create(
+                model=model_name,
+                display_name=f"nippotool-{now.date().isoformat()}",
+                system_instruction=system_instruction,
+                ttl=midnight - now
+            )
+            return genai.GenerativeModel.from_cached_content(cached_content)
+        except Exception:
+            # Models, tiers or prompt sizes without explicit caching support
+            pass
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+def count_input_token_savings(counting_model, input_text, now=None):
+    """用語辞書をプロンプトに含めていた場合と比べた入力トークン数の削減量を返す（counting_model は system_instruction 無し）"""
+    now = now or datetime.now()
+    before = counting_model.count_tokens(
+        get_system_prompt(now, INLINE_TERMINOLOGY_RULES) + "\n\n" + build_prompt(input_text, now)
+    ).total_tokens
+    after = counting_model.count_tokens(
+        get_system_prompt(now) + "\n\n" + build_prompt(normalizer.normalize(input_text), now)
+    ).total_tokens
+    return {"before": before, "after": after, "saved": before - after}
+
+def process_memo(model, input_text, model_name=MODEL_NAME, cache=None, stream=False, on_update=None, rate_limiter=None, now=None):
+    """メモを整理し、出力・未確認事項・レイテンシ・段階ごとの所要時間・トークン数を返す（プロンプト作成→生成→後処理）"""
+    now = now or datetime.now()
+    started_at = time.perf_counter()
+    normalized_text = normalizer.normalize(input_text)
+    prompt = build_prompt(normalized_text, now)
+    prompt_built_at = time.perf_counter()
+    generation_config = {"temperature": TEMPERATURE}
+    cache_key = None
+    cached_text = None
+    if cache is not None:
+        cache_key = make_cache_key(normalized_text, PROMPT_VERSION, model_name, TEMPERATURE, now.date().isoformat())
+        cached_text = cache.get(cache_key)
+    if cached_text is None and rate_limiter is not None:
+        # Cache hits do not count against the request budget
+        rate_limiter.acquire(estimate_tokens(get_system_prompt(now)) + estimate_tokens(prompt))
+    api_started_at = time.perf_counter()
+    usage = usage_counts(None)
+
+    if cached_text is not None:
+        # Cache hit: no API request is sent
+        generated_text = cached_text
+        api_finished_at = first_token_at = api_started_at
+    elif stream:
+        # Post-process completed lines as tokens arrive
+        processor = StreamingPostProcessor(input_text)
+        first_token_at = None
+        response = model.generate_content(
+            prompt,
+            generation_config=generation_config,
+            stream=True
+        )
+        for chunk in response:
+            # The last chunk carries the usage totals for the whole response
+            usage = usage_counts(chunk) if getattr(chunk, "usage_metadata", None) else usage
+            if not chunk.parts:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            processor.feed(chunk.text)
+            if on_update is not None:
+                on_update(processor.preview())
+
+        generated_text = processor.generated_text()
+        api_finished_at = time.perf_counter()
+        if first_token_at is None:
+            first_token_at = api_finished_at
+        if cache is not None:
+            cache.put(cache_key, generated_text)
+    else:
+        response = model.generate_content(
+            prompt,
+            generation_config=generation_config
+        )
+
+        generated_text = response.text
+        usage = usage_counts(response)
+        api_finished_at = first_token_at = time.perf_counter()
+        if cache is not None:
+            cache.put(cache_key, generated_text)
+
+    # Same post-processing on the full text for every path
+    # Extract unconfirmed items and clean the text
+    cleaned_text, unconfirmed_items = extract_unconfirmed_items(generated_text)
+    extracted_at = time.perf_counter()
+    # 入力に無い架空の人名を顧客に置換
+    cleaned_text = remove_placeholder_names(cleaned_text, input_text)
+    finished_at = time.perf_counter()
+
+    return {
+        "output": cleaned_text,
+        "unconfirmed": unconfirmed_items,
+        "latency": {
+            "mode": "cache" if cached_text is not None else ("stream" if stream else "batch"),
+            "ttft": round(first_token_at - started_at, 3),
+            "total": round(finished_at - started_at, 3)
+        },
+        "stages": {
+            "prompt": round(prompt_built_at - started_at, 4),
+            "queue": round(api_started_at - prompt_built_at, 4),
+            "api_ttft": round(first_token_at - api_started_at, 4),
+            "api_total": round(api_finished_at - api_started_at, 4),
+            "extract_unconfirmed": round(extracted_at - api_finished_at, 4),
+            "remove_names": round(finished_at - extracted_at, 4)
+        },
+        "tokens": usage
+    }
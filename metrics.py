@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.api_core import exceptions as api_exceptions
+
+# Stages recorded for each request, in pipeline order ("queue" is the cache
+# lookup and the rate-limiter or scheduler wait before the API call)
+STAGES = ["prompt", "queue", "api_ttft", "api_total", "extract_unconfirmed", "remove_names", "render"]
+ERROR_CLASSES = ["connection", "quota", "timeout", "auth", "other"]
+HISTOGRAM_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def classify_error(error):
+    """例外の型からエラーの種類（connection, quota, timeout, auth, other）を判定する"""
+    if isinstance(error, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)):
+        return "quota"
+    # RetryError is raised when the client's retry deadline runs out
+    if isinstance(error, (api_exceptions.DeadlineExceeded, api_exceptions.RetryError, TimeoutError)):
+        return "timeout"
+    if isinstance(error, (api_exceptions.Unauthenticated, api_exceptions.PermissionDenied)):
+        return "auth"
+    if isinstance(error, api_exceptions.InvalidArgument) and error.reason == "API_KEY_INVALID":
+        return "auth"
+    if isinstance(error, (api_exceptions.ServiceUnavailable, ConnectionError)):
+        return "connection"
+    return "other"
+
+
+def usage_counts(response):
+    """応答の usage_metadata からトークン数を取り出す（無い場合は0）"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    output = getattr(usage, "candidates_token_count", 0) or 0
+    return {"prompt": prompt, "output": output, "total": getattr(usage, "total_token_count", 0) or prompt + output}
+
+
+def percentile(values, q):
+    """最近傍法によるパーセンタイル（values は昇順）"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(-(-q * len(values) // 100)) - 1))]
+
+
+class MetricsLog:
+    """リクエストごとの計測値を追記専用のJSONLに記録し、Prometheus形式でも公開する"""
+
+    def __init__(self, directory, prometheus_file=None):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "metrics.jsonl")
+        self.prometheus_file = prometheus_file
+        self._lock = threading.Lock()
+        # Counters since process start; Prometheus handles the reset on restart
+        self._buckets = {stage: [0] * len(HISTOGRAM_BUCKETS) for stage in STAGES}
+        self._sums = {stage: 0.0 for stage in STAGES}
+        self._counts = {stage: 0 for stage in STAGES}
+        self._requests = {}
+        self._tokens = {"prompt": 0, "output": 0}
+        self._errors = {error_class: 0 for error_class in ERROR_CLASSES}
+
+    def record(self, event):
+        """計測値を1件追記する（event: mode, stages, tokens, error_class など）"""
+        event = {"timestamp": datetime.now().isoformat(timespec="seconds"), **event}
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._aggregate(event)
+            if self.prometheus_file:
+                # Replace atomically so a scraper never reads a partial file
+                temp_path = self.prometheus_file + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(self.prometheus_text())
+                os.replace(temp_path, self.prometheus_file)
+
+    def record_error(self, error, **fields):
+        """失敗したリクエストをエラーの種類とともに記録する"""
+        self.record({"status": "error", "error_class": classify_error(error), "error_type": type(error).__name__, **fields})
+
+    def read(self, since=None):
+        """記録を古い順に返す（since 以降のみ）"""
+        if not os.path.exists(self.path):
+            return []
+        since = since.isoformat(timespec="seconds") if since else ""
+        events = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash while appending
+                    continue
+                if event.get("timestamp", "") >= since:
+                    events.append(event)
+        return events
+
+    def _aggregate(self, event):
+        status = event.get("status", "ok")
+        key = (event.get("mode", "unknown"), status)
+        self._requests[key] = self._requests.get(key, 0) + 1
+        if status == "error":
+            self._errors[event.get("error_class", "other")] += 1
+        for stage, seconds in (event.get("stages") or {}).items():
+            if stage not in self._counts:
+                continue
+            self._sums[stage] += seconds
+            self._counts[stage] += 1
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if seconds <= bound:
+                    self._buckets[stage][i] += 1
+        for kind in self._tokens:
+            self._tokens[kind] += (event.get("tokens") or {}).get(kind, 0)
+
+    def prometheus_text(self):
+        """Prometheusのテキスト形式で集計値を返す"""
+        lines = [
+            "# HELP nippotool_stage_seconds Time spent in each stage of memo processing.",
+            "# TYPE nippotool_stage_seconds histogram"
+        ]
+        for stage in STAGES:
+            for bound, count in zip(HISTOGRAM_BUCKETS, self._buckets[stage]):
+                lines.append(f'nippotool_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'nippotool_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {self._counts[stage]}')
+            lines.append(f'nippotool_stage_seconds_sum{{stage="{stage}"}} {self._sums[stage]:.6f}')
+            lines.append(f'nippotool_stage_seconds_count{{stage="{stage}"}} {self._counts[stage]}')
+        lines += ["# HELP nippotool_requests_total Processed memos by mode and status.", "# TYPE nippotool_requests_total counter"]
+        for (mode, status), count in sorted(self._requests.items()):
+            lines.append(f'nippotool_requests_total{{mode="{mode}",status="{status}"}} {count}')
+        lines += ["# HELP nippotool_errors_total Failed requests by error class.", "# TYPE nippotool_errors_total counter"]
+        for error_class, count in self._errors.items():
+            lines.append(f'nippotool_errors_total{{class="{error_class}"}} {count}')
+        lines += ["# HELP nippotool_tokens_total Tokens reported by usage_metadata.", "# TYPE nippotool_tokens_total counter"]
+        for kind, count in self._tokens.items():
+            lines.append(f'nippotool_tokens_total{{kind="{kind}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port, host="127.0.0.1"):
+        """/metrics でPrometheus形式の集計値を返すHTTPサーバーを別スレッドで起動する"""
+        metrics_log = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                with metrics_log._lock:
+                    body = metrics_log.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
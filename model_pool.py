@@ -0,0 +1,250 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
+
+from google.api_core import exceptions as api_exceptions
+
+from metrics import classify_error, percentile
+from rate_limit import estimate_tokens
+
+# Error classes after which the next model in the pool is tried
+FAILOVER_ERRORS = {"quota", "timeout", "connection"}
+
+
+class PoolUnavailableError(api_exceptions.ResourceExhausted):
+    """全モデルのサーキットブレーカーが開いていて、送信できるモデルが無い"""
+
+
+def retry_delay(error):
+    """クォータエラーに含まれる RetryInfo の待ち時間（秒）。無い場合は None"""
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9 if hasattr(delay, "nanos") else delay.total_seconds()
+    return None
+
+
+class CircuitBreaker:
+    """クォータエラーが続いたモデルを一定時間使わないようにする"""
+
+    def __init__(self, failure_threshold=2, cooldown=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_until = None
+        # Set while the single trial request after the cooldown is in flight
+        self.half_open_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """送信してよいか（開いている間は False。待ち時間が過ぎたら試しに1回だけ通す）"""
+        with self._lock:
+            if self.opened_until is None:
+                return True
+            if self.clock() < self.opened_until or self.half_open_in_flight:
+                return False
+            self.half_open_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_until = None
+            self.half_open_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.half_open_in_flight = False
+            # A failed trial after the cooldown reopens the breaker at once
+            if self.failures >= self.failure_threshold or self.opened_until is not None:
+                self.opened_until = self.clock() + max(self.cooldown, retry_delay(error) or 0)
+
+    def release(self):
+        """試しの1回がクォータ以外の理由で失敗したとき、次の呼び出しに試しを譲る"""
+        with self._lock:
+            self.half_open_in_flight = False
+
+    def state(self):
+        with self._lock:
+            if self.opened_until is None:
+                return "closed"
+            return "open" if self.clock() < self.opened_until else "half-open"
+
+    def remaining(self):
+        """ブレーカーが閉じるまでの残り時間（秒）"""
+        with self._lock:
+            return max(0.0, self.opened_until - self.clock()) if self.opened_until is not None else 0.0
+
+
+class PoolMember:
+    """プール内の1モデル（ブレーカーと最近の応答時間を持つ）"""
+
+    def __init__(self, name, model, breaker, window=200):
+        self.name = name
+        self.model = model
+        self.breaker = breaker
+        # Time to the first response (first chunk when streaming)
+        self.latencies = deque(maxlen=window)
+        self.wins = 0
+        self.errors = {}
+
+
+class ModelPool:
+    """複数のモデルを順に使い分けるモデル（遅い応答には別モデルへのヘッジ、クォータエラーにはブレーカー）
+
+    generate_content / count_tokens は通常のモデルと同じように呼べる。"""
+
+    def __init__(self, models, hedge_after=10.0, hedge_percentile=95, min_samples=20, failure_threshold=2, cooldown=60.0, clock=time.monotonic, max_workers=32, rate_limiter=None, system_tokens=0):
+        """models: (名前, モデル) の優先順のリスト。hedge_after: 応答時間の記録が少ない間のヘッジまでの秒数
+
+        rate_limiter を指定すると、1回目より後の送信（ヘッジ・切り替え）もその予算に数える。
+        予算が無いときヘッジは送らず、切り替えは予算が空くまで待つ。"""
+        self.members = [PoolMember(name, model, CircuitBreaker(failure_threshold, cooldown, clock)) for name, model in models]
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.clock = clock
+        self.hedges = 0
+        # The first send is admitted by the caller (e.g. the scheduler); the
+        # extra sends made here are charged to the same budget
+        self.rate_limiter = rate_limiter
+        self.system_tokens = system_tokens
+        self._lock = threading.Lock()
+        # Shared by all sessions; an abandoned hedge keeps its thread until the API answers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-pool")
+
+    @property
+    def model_name(self):
+        return self.members[0].name
+
+    @property
+    def cached_content(self):
+        return getattr(self.members[0].model, "cached_content", None)
+
+    def count_tokens(self, contents):
+        return self.members[0].model.count_tokens(contents)
+
+    def hedge_deadline(self, member):
+        """このモデルの応答を待つ時間（記録が十分あれば p95 などのパーセンタイル）"""
+        if self.hedge_after is None:
+            return None
+        with self._lock:
+            samples = sorted(member.latencies)
+        if self.hedge_percentile is None or len(samples) < self.min_samples:
+            return self.hedge_after
+        return percentile(samples, self.hedge_percentile)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        # Breakers are asked only when a model is about to be used, since a
+        # half-open breaker hands its single trial to whoever asks first
+        remaining = iter(self.members)
+
+        def next_member():
+            return next((member for member in remaining if member.breaker.allow()), None)
+
+        pending = {}
+        errors = []
+        hedged = False
+        # A hedge skipped for lack of budget must not stop a later failover
+        hedge_skipped = False
+        members_left = True
+        deadline = started_at = None
+
+        def launch(extra=False, hedge=False):
+            nonlocal hedge_skipped, members_left, deadline, started_at
+            if extra and self.rate_limiter is not None:
+                tokens = self.system_tokens + estimate_tokens(contents)
+                if hedge:
+                    # A hedge is optional; without budget the primary is simply awaited
+                    if self.rate_limiter.reserve(tokens) > 0:
+                        hedge_skipped = True
+                        return False
+                else:
+                    self.rate_limiter.acquire(tokens)
+            member = next_member()
+            if member is None:
+                members_left = False
+                return False
+            pending[self._executor.submit(self._attempt, member, contents, generation_config, stream, kwargs)] = member
+            # The hedge timer follows the most recently started model
+            deadline = self.hedge_deadline(member)
+            started_at = self.clock()
+            return True
+
+        if not launch():
+            retry_in = min(member.breaker.remaining() for member in self.members)
+            raise PoolUnavailableError(f"All models are rate limited; retry in {retry_in:.0f}s")
+        while pending:
+            timeout = None
+            if not hedged and deadline is not None and members_left and not hedge_skipped:
+                timeout = max(0.0, deadline - (self.clock() - started_at))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The primary is slower than usual: race it against the next model
+                hedged = True
+                if launch(extra=True, hedge=True):
+                    with self._lock:
+                        self.hedges += 1
+                continue
+            for future in done:
+                member = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if classify_error(e) not in FAILOVER_ERRORS:
+                        raise
+                    errors.append(e)
+                    if not pending and members_left:
+                        launch(extra=True)
+                    continue
+                with self._lock:
+                    member.wins += 1
+                if stream:
+                    first_chunk, iterator = result
+                    return chain([first_chunk] if first_chunk is not None else [], iterator)
+                return result
+        raise errors[-1]
+
+    def _attempt(self, member, contents, generation_config, stream, kwargs):
+        started_at = self.clock()
+        try:
+            response = member.model.generate_content(contents, generation_config=generation_config, stream=stream, **kwargs)
+            if stream:
+                # Errors and slowness show up by the first chunk, so the race is decided there
+                iterator = iter(response)
+                response = (next(iterator, None), iterator)
+        except Exception as e:
+            error_class = classify_error(e)
+            with self._lock:
+                member.errors[error_class] = member.errors.get(error_class, 0) + 1
+            if error_class == "quota":
+                member.breaker.record_failure(e)
+            else:
+                # Other errors say nothing about the quota; let the next caller try
+                member.breaker.release()
+            raise
+        with self._lock:
+            member.latencies.append(self.clock() - started_at)
+        member.breaker.record_success()
+        return response
+
+    def status(self):
+        """各モデルの状態（ブレーカー・p95・勝ち数・エラー数）"""
+        rows = []
+        for member in self.members:
+            with self._lock:
+                samples = sorted(member.latencies)
+                wins, errors = member.wins, dict(member.errors)
+            rows.append({
+                "name": member.name,
+                "state": member.breaker.state(),
+                "retry_in": member.breaker.remaining(),
+                "p95": percentile(samples, 95),
+                "wins": wins,
+                "errors": errors
+            })
+        return rows
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import streamlit as st
+
+from metrics import ERROR_CLASSES, STAGES, MetricsLog, percentile
+
+st.set_page_config(
+    page_title="メトリクス - 面談メモ整理ツール",
+    page_icon="📊",
+    layout="wide"
+)
+
+st.title("📊 メトリクス")
+
+STAGE_LABELS = {
+    "prompt": "プロンプト作成",
+    "queue": "待ち（キャッシュ・送信キュー）",
+    "api_ttft": "API 初回応答",
+    "api_total": "API 合計",
+    "extract_unconfirmed": "未確認事項の抽出",
+    "remove_names": "人名の置換",
+    "render": "表示"
+}
+ERROR_LABELS = {"connection": "接続", "quota": "クォータ", "timeout": "タイムアウト", "auth": "認証", "other": "その他"}
+PERIODS = {"1時間": timedelta(hours=1), "24時間": timedelta(days=1), "7日間": timedelta(days=7), "30日間": timedelta(days=30)}
+
+metrics_log = MetricsLog(st.secrets.get("DATA_DIR", "data"))
+period = st.radio("期間", list(PERIODS), index=1, horizontal=True)
+events = metrics_log.read(since=datetime.now() - PERIODS[period])
+if not events:
+    st.info("📝 この期間の記録はまだありません。メモを整理すると、ここに計測結果が表示されます。")
+    st.stop()
+
+ok_events = [event for event in events if event.get("status", "ok") == "ok"]
+error_events = [event for event in events if event.get("status") == "error"]
+col_requests, col_errors, col_tokens = st.columns(3)
+col_requests.metric("リクエスト数", len(events))
+col_errors.metric("エラー率", f"{len(error_events) / len(events):.1%}")
+col_tokens.metric("合計トークン数", f"{sum((event.get('tokens') or {}).get('total', 0) for event in ok_events):,}")
+
+# Latency percentiles per stage (cache hits are left out of the API stages)
+st.subheader("⏱️ 段階ごとの所要時間")
+include_cache = st.toggle("キャッシュヒットを含める", value=False)
+rows = []
+for stage in STAGES:
+    values = sorted(
+        event["stages"][stage] for event in ok_events
+        if stage in (event.get("stages") or {}) and (include_cache or event.get("mode") != "cache")
+    )
+    if values:
+        rows.append({
+            "段階": STAGE_LABELS[stage],
+            "件数": len(values),
+            "p50 (ms)": percentile(values, 50) * 1000,
+            "p95 (ms)": percentile(values, 95) * 1000,
+            "p99 (ms)": percentile(values, 99) * 1000
+        })
+st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True, column_config={
+    column: st.column_config.NumberColumn(format="%.1f") for column in ("p50 (ms)", "p95 (ms)", "p99 (ms)")
+})
+
+# Trends are bucketed by hour (or by day for the longer periods)
+frequency = "h" if PERIODS[period] <= timedelta(days=1) else "D"
+
+st.subheader("🔢 トークン数の推移")
+token_frame = pd.DataFrame([
+    {"timestamp": event["timestamp"], "入力": event["tokens"].get("prompt", 0), "出力": event["tokens"].get("output", 0)}
+    for event in ok_events if event.get("tokens")
+])
+if token_frame.empty:
+    st.caption("トークン数の記録はありません。")
+else:
+    token_frame["timestamp"] = pd.to_datetime(token_frame["timestamp"])
+    st.area_chart(token_frame.set_index("timestamp").resample(frequency).sum())
+
+st.subheader("❌ エラーの推移")
+if not error_events:
+    st.caption("この期間のエラーはありません。")
+else:
+    error_frame = pd.DataFrame([
+        {"timestamp": event["timestamp"], "class": ERROR_LABELS[event.get("error_class", "other")]}
+        for event in error_events
+    ])
+    error_frame["timestamp"] = pd.to_datetime(error_frame["timestamp"])
+    error_counts = (
+        error_frame.groupby([pd.Grouper(key="timestamp", freq=frequency), "class"]).size()
+        .unstack(fill_value=0)
+        .reindex(columns=[ERROR_LABELS[error_class] for error_class in ERROR_CLASSES], fill_value=0)
+    )
+    st.bar_chart(error_counts)
@@ -0,0 +1,170 @@
+import re
+from functools import lru_cache
+
+# All patterns are compiled once at import time
+NAME_CHARS = r'[ァ-ヶーｦ-ﾟa-zA-Zぁ-ん\u4e00-\u9fff々]'
+HONORIFIC = r'(?:さん|くん|ちゃん|君|様|氏)'
+NAME_PATTERN = re.compile(rf'({NAME_CHARS}{{2,}})({HONORIFIC})')
+NAME_RUN_PATTERN = re.compile(rf'{NAME_CHARS}{{2,}}')
+
+_UNCONFIRMED = r'⚠️\s*\*?\*?未確認\*?\*?:\s*'
+_GAP = r'\s*\n\s*'
+_SEPARATOR = r'-{4,}'
+# The same three passes as before (the warning wrapped in separator lines, a
+# bare warning line, then separator pairs left adjacent), compiled once; a
+# single combined pass cannot reproduce them on stacked separator lines
+UNCONFIRMED_PATTERN = re.compile(rf'{_UNCONFIRMED}([^\n]+)')
+UNCONFIRMED_BLOCK_PATTERN = re.compile(rf'{_SEPARATOR}{_GAP}{_UNCONFIRMED}[^\n]+{_GAP}{_SEPARATOR}')
+SEPARATOR_PAIR_PATTERN = re.compile(rf'{_SEPARATOR}{_GAP}{_SEPARATOR}')
+
+# Streaming output: post-process completed lines while tokens arrive
+UNCONFIRMED_LINE_PATTERN = UNCONFIRMED_PATTERN
+SEPARATOR_LINE_PATTERN = re.compile(_SEPARATOR)
+
+
+# Below this many characters to compare, plain substring searches beat compiling a trie
+TRIE_SCAN_MIN_WORK = 5_000_000
+# Inputs at least this long resolve all output names up front in a single scan
+BATCH_RESOLVE_MIN_CHARS = 50_000
+
+
+def trie_pattern(words):
+    """単語集合から共通接頭辞をまとめた正規表現を作る（最長一致）"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        alternatives = [re.escape(ch) + build(child) for ch, child in node.items() if ch]
+        if not alternatives:
+            return ""
+        body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class NameIndex:
+    """入力テキストに登場する名前を高速に判定するための索引"""
+
+    def __init__(self, input_text):
+        self.input_text = input_text
+        # Names written with an honorific in the input resolve in O(1)
+        self._known = {m.group(1): True for m in NAME_PATTERN.finditer(input_text)}
+        self._corpus = None
+
+    def resolve(self, names):
+        """未判定の名前をまとめて判定する（入力の走査は1回）"""
+        unresolved = {name for name in names if name not in self._known}
+        if len(unresolved) * len(self.input_text) < TRIE_SCAN_MIN_WORK:
+            for name in unresolved:
+                self._known[name] = name in self.input_text
+            return
+        if self._corpus is None:
+            # A name is made of name characters only, so it can occur in the
+            # input only inside one of its (deduplicated) maximal runs
+            self._corpus = "\n".join(set(NAME_RUN_PATTERN.findall(self.input_text)))
+        # Aho-Corasick style: one scan finds the longest candidate starting at
+        # each position; shorter candidates there are its prefixes
+        scanner = re.compile("(?=(" + trie_pattern(unresolved) + "))")
+        for name in unresolved:
+            self._known[name] = False
+        for match in scanner.finditer(self._corpus):
+            found = match.group(1)
+            for end in range(2, len(found) + 1):
+                if found[:end] in unresolved:
+                    self._known[found[:end]] = True
+
+    def __contains__(self, name):
+        found = self._known.get(name)
+        if found is None:
+            found = self._known[name] = name in self.input_text
+        return found
+
+
+@lru_cache(maxsize=16)
+def get_name_index(input_text):
+    """同じ入力に対する索引を使い回す（ストリーミング時は行ごとに呼ばれるため）"""
+    return NameIndex(input_text)
+
+
+def remove_placeholder_names(text, input_text):
+    """入力に無い人名を顧客に置換する"""
+    name_index = get_name_index(input_text)
+    if len(input_text) >= BATCH_RESOLVE_MIN_CHARS:
+        name_index.resolve({m.group(1) for m in NAME_PATTERN.finditer(text)})
+
+    def replace_if_not_in_input(match):
+        # 入力に名前自体が含まれていれば許可
+        if match.group(1) in name_index:
+            return match.group(0)
+        return '顧客'
+
+    return NAME_PATTERN.sub(replace_if_not_in_input, text)
+
+
+def extract_unconfirmed_items(text):
+    """未確認事項を抽出し、テキストから削除する"""
+    if "未確認" not in text:
+        return text.strip(), None
+
+    match = UNCONFIRMED_PATTERN.search(text)
+    if not match:
+        return text.strip(), None
+    text_cleaned = UNCONFIRMED_BLOCK_PATTERN.sub('', text)
+    text_cleaned = UNCONFIRMED_PATTERN.sub('', text_cleaned)
+    text_cleaned = SEPARATOR_PAIR_PATTERN.sub('', text_cleaned)
+    return text_cleaned.strip(), match.group(1).strip()
+
+
+class StreamingPostProcessor:
+    """ストリーミング出力を確定した行ごとに後処理する"""
+
+    def __init__(self, input_text):
+        self.input_text = input_text
+        self.unconfirmed_items = None
+        self._chunks = []
+        self._pending = ""
+        self._lines = []
+        # 未確認行を囲む区切り線かもしれないため、次の行が来るまで表示を保留する
+        self._held_separators = []
+        self._drop_next_separator = False
+
+    def feed(self, chunk):
+        """受信したチャンクを追加し、改行で確定した行を処理する"""
+        self._chunks.append(chunk)
+        *completed, self._pending = (self._pending + chunk).split("\n")
+        for line in completed:
+            self._process_line(line)
+
+    def _process_line(self, line):
+        stripped = line.strip()
+        match = UNCONFIRMED_LINE_PATTERN.match(stripped)
+        if match:
+            if self.unconfirmed_items is None:
+                self.unconfirmed_items = match.group(1).strip()
+            self._held_separators = []
+            self._drop_next_separator = True
+            return
+        if SEPARATOR_LINE_PATTERN.fullmatch(stripped):
+            if self._drop_next_separator:
+                self._drop_next_separator = False
+            else:
+                self._held_separators.append(line)
+            return
+        if stripped:
+            self._drop_next_separator = False
+        self._lines.extend(self._held_separators)
+        self._held_separators = []
+        self._lines.append(remove_placeholder_names(line, self.input_text))
+
+    def preview(self):
+        """確定済みの行だけを表示用に返す"""
+        return "\n".join(self._lines).strip()
+
+    def generated_text(self):
+        """受信済みの生成テキスト全文を返す"""
+        return "".join(self._chunks)
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import deque
+
+
+def estimate_tokens(text):
+    """送信トークン数を概算する（日本語はおおむね1文字1トークン以下のため文字数を上限として使う）"""
+    return len(text)
+
+
+class SlidingWindow:
+    """直近 window 秒間の合計が limit を超えないようにする予算（APIのクォータと同じ数え方）"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._entries = deque()
+        self._total = 0
+
+    def _expire(self, now):
+        while self._entries and self._entries[0][0] <= now - self.window:
+            self._total -= self._entries.popleft()[1]
+
+    def wait_time(self, amount, now):
+        """amount 分を追加しても上限を超えなくなるまでの秒数を返す（0なら即時取得可能）"""
+        self._expire(now)
+        amount = min(amount, self.limit)
+        excess = self._total + amount - self.limit
+        if excess <= 0:
+            return 0.0
+        # Wait until enough of the oldest entries have left the window
+        for taken_at, size in self._entries:
+            excess -= size
+            if excess <= 0:
+                return taken_at + self.window - now
+        return self.window
+
+    def take(self, amount, now=None):
+        amount = min(amount, self.limit)
+        self._entries.append((time.monotonic() if now is None else now, amount))
+        self._total += amount
+
+
+class RateLimiter:
+    """1分あたりのリクエスト数・トークン数の両方を守るレートリミッター
+
+    直近 period 秒間の合計で数えるため、一時的にも上限を超えない
+    （トークンバケットは満杯からの一気の送信と補充分とで、1つの区間に最大2倍まで通してしまう）。"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, period=60.0):
+        self._lock = threading.Lock()
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.period = period
+        self._requests = SlidingWindow(requests_per_minute, period)
+        self._tokens = None
+        if tokens_per_minute:
+            self._tokens = SlidingWindow(tokens_per_minute, period)
+
+    def reserve(self, tokens=0):
+        """予算が空いていれば確保して0を、空いていなければ待つべき秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._requests.wait_time(1, now)
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self._requests.take(1, now)
+            if self._tokens is not None:
+                self._tokens.take(tokens, now)
+            return 0.0
+
+    def acquire(self, tokens=0):
+        """リクエスト1件と tokens 分の予算が確保できるまで待つ"""
+        while True:
+            wait = self.reserve(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date
+
+
+def normalize_memo(text):
+    """空白・改行の揺れを吸収したメモ本文を返す"""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def make_cache_key(input_text, prompt_version, model_name, temperature, day=None):
+    """メモ・プロンプト版・モデル名・温度・日付からキャッシュキーを作る"""
+    day = day or date.today().isoformat()
+    parts = [normalize_memo(input_text), prompt_version, model_name, repr(float(temperature)), day]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Gemini応答のSQLiteキャッシュ（LRU件数上限・TTL・日次切り替え）"""
+
+    def __init__(self, directory, max_entries=500, ttl_seconds=7 * 24 * 3600):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "response_cache.sqlite3")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._rolled_over_on = None
+        # Streamlit sessions run in separate threads and share this instance
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                day TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """キャッシュされた生成テキストを返す（無い・期限切れの場合は None）"""
+        now = time.time()
+        with self._lock:
+            self._roll_over()
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        """生成テキストを保存し、上限を超えた古いエントリを削除する"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, day, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, date.today().isoformat(), value, now, now)
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        """全エントリを削除する"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        """ヒット・ミス回数と保存件数を返す"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def _roll_over(self):
+        # The prompt embeds today's date, so earlier days' responses are stale
+        today = date.today().isoformat()
+        if self._rolled_over_on == today:
+            return
+        self._conn.execute("DELETE FROM responses WHERE day < ?", (today,))
+        self._conn.commit()
+        self._rolled_over_on = today
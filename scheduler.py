@@ -0,0 +1,277 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import classify_error
+from model_pool import retry_delay
+from rate_limit import RateLimiter, estimate_tokens
+
+
+class SharedStream:
+    """1つのストリーミング応答を、同じメモを待つ全セッションに配る"""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def append(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.finished = True
+            self.error = error
+            self._cond.notify_all()
+
+    def wait_ready(self, timeout):
+        """最初のチャンクが届くか終了するまで待つ"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.chunks or self.finished, timeout)
+
+    def subscribe(self):
+        """届いたチャンクを先頭から順に返す（途中から参加しても全体を受け取る）"""
+        index = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: index < len(self.chunks) or self.finished)
+                if index >= len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+                chunk = self.chunks[index]
+            index += 1
+            yield chunk
+
+
+class Job:
+    """スケジューラーの待ち行列に入る生成リクエスト1件"""
+
+    def __init__(self, key, session_id, call, stream, tokens, clock):
+        self.key = key
+        self.session_id = session_id
+        self.call = call
+        self.tokens = tokens
+        self.queued_at = clock()
+        self.started_at = None
+        self.attempts = 0
+        self.waiters = 1
+        self.response = None
+        self.error = None
+        self.stream = SharedStream() if stream else None
+        self._done = threading.Event()
+
+    def wait_ready(self, timeout):
+        """結果（ストリーミングでは最初のチャンク）が届いたら True"""
+        if self.stream is not None:
+            return self.stream.wait_ready(timeout)
+        return self._done.wait(timeout)
+
+
+class Scheduler:
+    """サーバー全体で生成リクエストを順番に送るスケジューラー
+
+    - 1分あたりのリクエスト数・トークン数の予算内でだけ送信する（直近1分間の合計で数える）
+    - 同じプロンプトが同時に送られたら1回だけ送信し、結果を共有する（single-flight）
+    - セッションごとの待ち行列から順番に取り出す（1人が大量に送っても他の人を待たせない）"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, max_concurrent=4, max_retries=3, period=60.0, headroom=0.05, clock=time.monotonic):
+        """headroom: 予算の区間を period より長くする割合（API側が送信より少し遅れて数える分）"""
+        # Each request is counted when it is sent, but the API counts it on
+        # arrival; without the headroom a window reopened here can still be
+        # full on the API side
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute, period=period * (1 + headroom))
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.clock = clock
+        self.stats = {"submitted": 0, "shared": 0, "sent": 0, "retried": 0}
+        # Moving average of the time from sending to the full response, for the ETA
+        self.service_time = 5.0
+        self._cond = threading.Condition()
+        # session_id -> queued jobs; the session served last moves to the end
+        self._queues = OrderedDict()
+        self._jobs = {}
+        self._running = 0
+        self._paused_until = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="scheduler")
+        threading.Thread(target=self._dispatch_loop, name="scheduler-dispatch", daemon=True).start()
+
+    def submit(self, session_id, key, call, stream=False, tokens=0):
+        """生成リクエストを待ち行列に入れる（同じ key が待ち行列・送信中にあればそれに相乗りする）"""
+        with self._cond:
+            self.stats["submitted"] += 1
+            job = self._jobs.get(key)
+            if job is not None:
+                job.waiters += 1
+                self.stats["shared"] += 1
+                return job
+            job = Job(key, session_id, call, stream, tokens, self.clock)
+            self._jobs[key] = job
+            self._queues.setdefault(session_id, deque()).append(job)
+            self._cond.notify_all()
+            return job
+
+    def position(self, job):
+        """待ち行列での順番（1始まり。送信済みなら0）"""
+        with self._cond:
+            return self._position(job)
+
+    def eta(self, job):
+        """結果が届くまでのおおよその秒数"""
+        with self._cond:
+            position = self._position(job)
+            if position == 0:
+                return max(0.0, self.service_time - (self.clock() - job.started_at))
+            # Jobs ahead are limited both by the request budget and by the free slots
+            by_rate = (position - 1) * self.rate_limiter.period / self.rate_limiter.requests_per_minute
+            by_slots = (position + self._running - 1) // self.max_concurrent * self.service_time
+            paused = max(0.0, self._paused_until - self.clock())
+            return paused + max(by_rate, by_slots) + self.service_time
+
+    def status(self):
+        """待ち行列の状態（待ち件数・送信中の件数・セッション数・累計）"""
+        with self._cond:
+            return {
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "running": self._running,
+                "sessions": len(self._queues),
+                **self.stats
+            }
+
+    def _position(self, job):
+        if job.started_at is not None:
+            return 0
+        # Round-robin order over the sessions, as the dispatcher will take them
+        queues = list(self._queues.values())
+        position = 0
+        for depth in range(max((len(queue) for queue in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    if queue[depth] is job:
+                        return position
+        return position + 1
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                now = self.clock()
+                if not self._queues or self._running >= self.max_concurrent or now < self._paused_until:
+                    self._cond.wait(timeout=max(0.0, self._paused_until - now) or None)
+                    continue
+                session_id, queue = next(iter(self._queues.items()))
+                job = queue[0]
+                wait = self.rate_limiter.reserve(job.tokens)
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+                queue.popleft()
+                # The served session goes to the back of the rotation
+                del self._queues[session_id]
+                if queue:
+                    self._queues[session_id] = queue
+                job.started_at = self.clock()
+                job.attempts += 1
+                self._running += 1
+                self.stats["sent"] += 1
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        error = None
+        try:
+            response = job.call()
+            if job.stream is not None:
+                for chunk in response:
+                    job.stream.append(chunk)
+            else:
+                job.response = response
+        except Exception as e:
+            error = e
+        with self._cond:
+            self._running -= 1
+            elapsed = self.clock() - job.started_at
+            retry = (
+                error is not None
+                and classify_error(error) == "quota"
+                and job.attempts <= self.max_retries
+                and (job.stream is None or not job.stream.chunks)
+            )
+            if retry:
+                # The key's quota is shared, so every session waits before the next send
+                self.stats["retried"] += 1
+                self._paused_until = max(self._paused_until, self.clock() + (retry_delay(error) or 2.0 ** job.attempts))
+                job.started_at = None
+                queue = self._queues.pop(job.session_id, deque())
+                queue.appendleft(job)
+                self._queues[job.session_id] = queue
+                self._queues.move_to_end(job.session_id, last=False)
+            else:
+                self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+                del self._jobs[job.key]
+            self._cond.notify_all()
+        if retry:
+            return
+        job.error = error
+        if job.stream is not None:
+            job.stream.finish(error)
+        job._done.set()
+
+
+class ScheduledModel:
+    """generate_content をスケジューラー経由で送るモデル（1セッション・1回の実行ごとに作る）"""
+
+    def __init__(self, scheduler, model, session_id, system_tokens=0, on_wait=None, poll_interval=0.5):
+        """on_wait(順番, 残り秒数) は結果を待つ間 poll_interval 秒ごとに呼ばれる（順番0は送信済み）"""
+        self.scheduler = scheduler
+        self.model = model
+        self.session_id = session_id
+        self.system_tokens = system_tokens
+        self.on_wait = on_wait
+        self.poll_interval = poll_interval
+        # Time spent in the queue before the API call was sent (the longest
+        # of the calls made through this model, e.g. a long memo's chunks)
+        self.waited = 0.0
+        self.shared = False
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        key = hashlib.sha256(
+            f"{getattr(self.model, 'model_name', '')}\n{generation_config}\n{stream}\n{contents}".encode("utf-8")
+        ).hexdigest()
+        job = self.scheduler.submit(
+            self.session_id,
+            key,
+            lambda: self.model.generate_content(contents, generation_config=generation_config, stream=stream, **kwargs),
+            stream=stream,
+            tokens=self.system_tokens + estimate_tokens(contents)
+        )
+        self.shared = job.waiters > 1
+        submitted_at = self.scheduler.clock()
+        while not job.wait_ready(self.poll_interval):
+            if self.on_wait is not None:
+                self.on_wait(self.scheduler.position(job), self.scheduler.eta(job))
+        # A job joined while already running was not waited for
+        started_at = job.started_at
+        if started_at is not None:
+            self.waited = max(self.waited, started_at - submitted_at)
+        if stream:
+            return job.stream.subscribe()
+        if job.error is not None:
+            raise job.error
+        return job.response
+
+    def move_wait_to_queue(self, stages):
+        """段階ごとの所要時間から、送信キューでの待ち時間を API の段階から "queue" に移したものを返す"""
+        stages = dict(stages)
+        stages["queue"] = round(stages.get("queue", 0.0) + self.waited, 4)
+        for stage in ("api_ttft", "api_total"):
+            if stage in stages:
+                stages[stage] = round(max(0.0, stages[stage] - self.waited), 4)
+        return stages
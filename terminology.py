@@ -0,0 +1,78 @@
+import json
+import os
+import re
+
+from postprocess import trie_pattern
+
+TERMINOLOGY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "terminology.json")
+
+
+# Matching runs on a folded copy of the text (katakana -> hiragana, ASCII
+# lowercase). Every mapping is one character to one character, so match
+# positions in the folded copy are valid in the original text
+FOLD_TABLE = str.maketrans(
+    {chr(code): chr(code - 0x60) for code in range(ord("ァ"), ord("ヶ") + 1)}
+    | {chr(code): chr(code + 0x20) for code in range(ord("A"), ord("Z") + 1)}
+)
+
+
+# A variant written only in kana is a word only at a word boundary: it is
+# left alone when more kana follows (かんぽうやく, あいおいさん) unless that
+# kana is a particle, and when an honorific follows
+KANA_WORD_PATTERN = re.compile(r'[ぁ-ゖー]+')
+PARTICLE_PATTERN = re.compile(r'から|まで|など|より|って|です|じゃ|[のでにはがをともへやかだ]')
+HONORIFIC_PATTERN = re.compile(r'様|氏|君|殿|先生')
+
+
+def fold(text):
+    """表記揺れを吸収した照合用の文字列を返す"""
+    return text.translate(FOLD_TABLE)
+
+
+class TerminologyNormalizer:
+    """辞書の用語を最長一致で正式な用語に置き換える"""
+
+    def __init__(self, terms, keep=(), version=None):
+        self.version = version
+        # Protected terms (None) and canonical forms also take part in the
+        # longest match, so "あいおいニッセイ" and "あいおい生命" are not rewritten
+        self._replacements = {fold(term): None for term in keep}
+        for term in terms:
+            canonical = term["canonical"]
+            for variant in [canonical, *term["variants"]]:
+                self._replacements.setdefault(fold(variant), canonical)
+        self._kana_variants = {variant for variant in self._replacements if KANA_WORD_PATTERN.fullmatch(variant)}
+        self._pattern = re.compile(trie_pattern(self._replacements))
+
+    def _continues_word(self, folded, match):
+        """かなだけの用語のあとに、同じ語の続き（助詞以外のかな・敬称）が続くか"""
+        if match.group(0) not in self._kana_variants:
+            return False
+        end = match.end()
+        if HONORIFIC_PATTERN.match(folded, end):
+            return True
+        return bool(KANA_WORD_PATTERN.match(folded, end)) and not PARTICLE_PATTERN.match(folded, end)
+
+    def normalize(self, text):
+        """テキスト中の用語を正式な用語に統一する（1回の走査）"""
+        pieces = []
+        position = 0
+        folded = fold(text)
+        for match in self._pattern.finditer(folded):
+            replacement = self._replacements[match.group(0)]
+            if replacement is None or self._continues_word(folded, match):
+                continue
+            pieces.append(text[position:match.start()])
+            pieces.append(replacement)
+            position = match.end()
+        if not pieces:
+            return text
+        pieces.append(text[position:])
+        return "".join(pieces)
+
+
+def load_normalizer(path=TERMINOLOGY_PATH):
+    """用語辞書ファイルを読み込んで TerminologyNormalizer を作る"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return TerminologyNormalizer(data["terms"], data.get("keep", ()), data.get("version"))
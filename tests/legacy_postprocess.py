@@ -0,0 +1,72 @@
+import random
+import re
+
+# Reference implementations from before the post-processing was optimized,
+# and the synthetic memos used to compare against them (golden tests,
+# benchmarks and bench.py)
+
+KATAKANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワ"
+TOPICS = ["終身保険", "解約返戻金", "定期支払金", "市場価格調整", "ガンの自由診療特約", "年金", "資産運用"]
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+
+def legacy_remove_placeholder_names(text, input_text):
+    """比較用：最適化前の実装"""
+    name_chars = r'[ァ-ヶーｦ-ﾟa-zA-Zぁ-ん\u4e00-\u9fff々]{2,}'
+    suffix = r'(?:さん|くん|ちゃん|君|様|氏)'
+    pattern = rf'({name_chars})({suffix})'
+    input_names = set()
+    for m in re.finditer(pattern, input_text):
+        input_names.add(m.group(1))
+
+    def replace_if_not_in_input(match):
+        name = match.group(1)
+        if name in input_names or name in input_text:
+            return match.group(0)
+        return '顧客'
+
+    return re.sub(pattern, replace_if_not_in_input, text)
+
+
+def legacy_extract_unconfirmed_items(text):
+    """比較用：最適化前の実装"""
+    match = re.search(r'⚠️\s*\*?\*?未確認\*?\*?:\s*([^\n]+)', text)
+    if match:
+        unconfirmed_items = match.group(1).strip()
+        text_cleaned = re.sub(r'-{4,}\s*\n\s*⚠️\s*\*?\*?未確認\*?\*?:\s*[^\n]+\s*\n\s*-{4,}', '', text, flags=re.MULTILINE)
+        text_cleaned = re.sub(r'⚠️\s*\*?\*?未確認\*?\*?:\s*[^\n]+', '', text_cleaned)
+        text_cleaned = re.sub(r'-{4,}\s*\n\s*-{4,}', '', text_cleaned)
+        return text_cleaned.strip(), unconfirmed_items
+    return text.strip(), None
+
+
+def make_name(rng):
+    return "".join(rng.choice(KATAKANA) for _ in range(rng.randint(2, 4)))
+
+
+def make_memo(size, seed=0):
+    """人名を多く含む合成メモ（約 size 文字）と、それに対する■形式の出力を作る"""
+    rng = random.Random(seed)
+    names = [make_name(rng) for _ in range(max(size // 200, 10))]
+    sentences = []
+    length = 0
+    while length < size:
+        sentence = f"{rng.choice(names)}さんと{rng.choice(TOPICS)}について話した。"
+        sentences.append(sentence)
+        length += len(sentence)
+    memo = "\n".join(sentences)
+
+    # Half of the names in the output come from the memo, half are invented
+    details = []
+    for _ in range(max(size // 100, 20)):
+        name = rng.choice(names) if rng.random() < 0.5 else make_name(rng) + "ン"
+        details.append(f"- {name}さんに{rng.choice(TOPICS)}を説明した")
+    output = (
+        "--------------------------------------------------\n"
+        "■面談概要\n\n面談を行った。\n\n■詳細内容\n\n"
+        + "\n".join(details)
+        + "\n\n--------------------------------------------------\n"
+        "⚠️ **未確認**: 面談日時・形式, ToDo\n"
+        "--------------------------------------------------\n"
+    )
+    return memo, output
@@ -0,0 +1,140 @@
+import json
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+import batch
+from batch import call_with_retry, main, read_memos, run_batch
+from fake_model import FakeGenerativeModel, ScriptedModel
+from rate_limit import RateLimiter
+
+
+class LineCounter:
+    """run_batch の出力先（書き出した行を数える）"""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.extend(line for line in text.split("\n") if line)
+
+    def flush(self):
+        pass
+
+
+def test_read_memos_from_directory(tmp_path):
+    (tmp_path / "b.md").write_text("2件目", encoding="utf-8")
+    (tmp_path / "a.txt").write_text("1件目", encoding="utf-8")
+    (tmp_path / "notes.json").write_text("{}", encoding="utf-8")
+    assert list(read_memos(str(tmp_path))) == [("a", "1件目"), ("b", "2件目")]
+
+
+def test_read_memos_from_jsonl(tmp_path):
+    path = tmp_path / "memos.jsonl"
+    path.write_text('{"id": "x", "input": "1件目"}\n\n{"text": "2件目"}\n', encoding="utf-8")
+    # Blank lines are skipped; a record without an id is named by its line number
+    assert list(read_memos(str(path))) == [("x", "1件目"), ("3", "2件目")]
+
+
+def test_call_with_retry_backs_off_on_quota_errors(monkeypatch):
+    delays = []
+    monkeypatch.setattr(batch.time, "sleep", delays.append)
+    monkeypatch.setattr(batch.random, "random", lambda: 0.5)
+    outcomes = [api_exceptions.ResourceExhausted("429"), api_exceptions.ResourceExhausted("429"), "ok"]
+    errors = []
+
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert call_with_retry(call, base_delay=1.0, on_error=errors.append) == "ok"
+    assert delays == [1.0, 2.0]
+    assert len(errors) == 2
+
+
+def test_call_with_retry_gives_up():
+    calls = []
+
+    def quota():
+        calls.append(1)
+        raise api_exceptions.ResourceExhausted("429")
+
+    with pytest.raises(api_exceptions.ResourceExhausted):
+        call_with_retry(quota, max_retries=2, base_delay=0)
+    assert len(calls) == 3
+
+    def timeout():
+        calls.append(1)
+        raise api_exceptions.DeadlineExceeded("504")
+
+    # Only quota errors are retried
+    with pytest.raises(api_exceptions.DeadlineExceeded):
+        call_with_retry(timeout, base_delay=0)
+    assert len(calls) == 4
+
+
+def test_run_batch_writes_one_line_per_memo():
+    out = LineCounter()
+    memos = [(f"m{i}", f"{i}件目のメモ。イサオさんと面談した。") for i in range(10)]
+    counts = run_batch(memos, out, FakeGenerativeModel(), RateLimiter(6000), workers=3, base_delay=0)
+    assert counts == {"ok": 10, "partial": 0, "error": 0}
+    results = [json.loads(line) for line in out.lines]
+    assert sorted(result["id"] for result in results) == [f"m{i}" for i in range(10)]
+    assert all("■面談概要" in result["output"] for result in results)
+
+
+def test_run_batch_counts_errors_after_retries():
+    out = LineCounter()
+    model = FakeGenerativeModel(quota_error_rate=1.0)
+    counts = run_batch([("m1", "メモ")], out, model, RateLimiter(6000), max_retries=2, base_delay=0)
+    assert counts == {"ok": 0, "partial": 0, "error": 1}
+    result = json.loads(out.lines[0])
+    assert result["error"].startswith("ResourceExhausted")
+    assert result["attempts"] == 3
+    assert model.calls == 3
+
+
+def test_run_batch_recovers_from_occasional_quota_errors():
+    model = FakeGenerativeModel(quota_error_rate=0.3, seed=1)
+    memos = [(f"m{i}", f"{i}件目のメモ。") for i in range(10)]
+    counts = run_batch(memos, LineCounter(), model, RateLimiter(6000), max_retries=10, base_delay=0)
+    assert counts == {"ok": 10, "partial": 0, "error": 0}
+    assert model.calls > 10
+
+
+def test_run_batch_counts_long_memos_with_failed_chunks_as_partial():
+    # Two chunks; one of them times out, which is not retried
+    model = ScriptedModel([(0.0, "ok"), (0.0, "timeout")])
+    memo = "面談した。" * 1000 + "\n\n" + "保険の話をした。" * 700
+    out = LineCounter()
+    counts = run_batch([("long", memo)], out, model, RateLimiter(6000), long_memo_chars=1000, base_delay=0)
+    assert counts == {"ok": 0, "partial": 1, "error": 0}
+    assert json.loads(out.lines[0])["failed_chunks"] in ([1], [2])
+
+
+def test_run_batch_bounds_memos_in_flight():
+    out = LineCounter()
+    lags = []
+
+    def memos():
+        for i in range(20):
+            # Memos read but not yet written are the ones held in memory
+            lags.append(i - len(out.lines))
+            yield f"m{i}", f"{i}件目のメモ。"
+
+    run_batch(memos(), out, FakeGenerativeModel(latency=0.01), RateLimiter(6000), workers=2, base_delay=0)
+    assert len(out.lines) == 20
+    assert max(lags) <= 2 * 2 + 1
+
+
+def test_main_with_fake_model(tmp_path):
+    memo_dir = tmp_path / "memos"
+    memo_dir.mkdir()
+    for i in range(3):
+        (memo_dir / f"{i}.txt").write_text(f"{i}件目のメモ。", encoding="utf-8")
+    output = tmp_path / "out.jsonl"
+    status = main([str(memo_dir), "-o", str(output), "--fake", "--fake-latency", "0", "--no-cache", "--data-dir", str(tmp_path / "data")])
+    assert status == 0
+    assert len(output.read_text(encoding="utf-8").splitlines()) == 3
@@ -0,0 +1,78 @@
+import pytest
+
+from history_store import HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    for text in ["田中と面談", "田中が来訪", "日生の年金を解約", "あいおい生命の終身保険"]:
+        store.add({"input": text, "output": text}, "advisor-a")
+    store.add({"input": "田中さんの件", "output": "田中さんの件"}, "advisor-b")
+    return store
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("田中", 2),
+    ("来訪", 1),
+    ("日生", 1),
+    ("年金", 1),
+    ("終身保険", 1),
+    ("田中 来訪", 1),
+    ("", 4),
+])
+def test_search(store, query, expected):
+    assert store.search("advisor-a", query)[1] == expected
+
+
+def test_rows_are_scoped_to_the_owner(store):
+    rows, total = store.search("advisor-b", "田中")
+    assert total == 1
+    assert store.get(rows[0]["id"], "advisor-a") is None
+    assert store.get(rows[0]["id"], "advisor-b")["input"] == "田中さんの件"
+
+
+def test_clear_removes_only_the_owners_rows(store):
+    store.clear("advisor-a")
+    assert store.search("advisor-a")[1] == 0
+    assert store.search("advisor-b", "田中さん")[1] == 1
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("100%", 1),
+    ("%", 1),
+    ("a_b", 1),
+    ("_", 1),
+    ("中", 3),
+    ("0%", 1),
+])
+def test_like_wildcards_are_literal(tmp_path, query, expected):
+    store = HistoryStore(str(tmp_path))
+    for text in ["保障100%の特約", "a_bプラン", "田中", "中村", "中途解約", "axbプラン"]:
+        store.add({"input": text, "output": ""}, "advisor-a")
+    assert store.search("advisor-a", query)[1] == expected
+
+
+@pytest.mark.parametrize("query", ["日生", "田"])
+def test_short_terms_use_their_own_index(store, query):
+    where, _ = store._build_filter(query)
+    assert "history_short" in where
+    assert store.search("advisor-a", "ab")[1] == 0
+
+
+def test_cleared_rows_leave_no_short_grams(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.add({"input": "日生の件", "output": ""}, "advisor-a")
+    store.clear("advisor-a")
+    # The new row may reuse the deleted row's ID
+    store.add({"input": "別の件", "output": ""}, "advisor-a")
+    assert store.search("advisor-a", "日生")[1] == 0
+    assert store.search("advisor-a", "別の")[1] == 1
+
+
+def test_existing_rows_are_indexed_on_upgrade(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.add({"input": "日生の件", "output": ""}, "advisor-a")
+    store._conn.execute("DROP TABLE history_short")
+    store._conn.commit()
+    assert HistoryStore(str(tmp_path)).search("advisor-a", "日生")[1] == 1
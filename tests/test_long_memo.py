@@ -0,0 +1,110 @@
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from fake_model import FakeGenerativeModel, ScriptedModel
+from long_memo import merge_sections, process_long_memo, split_memo
+
+LONG_MEMO = "面談した。" * 1000 + "\n\n" + "保険の話をした。" * 700
+
+
+def test_split_memo_prefers_paragraphs():
+    text = "あ" * 40 + "\n\n" + "い" * 40 + "\n\n" + "う" * 10
+    assert split_memo(text, max_chars=60) == ["あ" * 40, "い" * 40 + "\n" + "う" * 10]
+
+
+def test_split_memo_falls_back_to_sentences_and_hard_cuts():
+    assert split_memo("あいう。えお。", max_chars=4) == ["あいう。", "えお。"]
+    assert split_memo("あ" * 10, max_chars=4) == ["ああああ", "ああああ", "ああ"]
+
+
+def test_split_memo_keeps_short_text_whole():
+    assert split_memo("短いメモ。", max_chars=100) == ["短いメモ。"]
+
+
+def test_merge_sections_deduplicates_lines():
+    merged = merge_sections([
+        "■詳細内容\n\n- 終身保険の説明\n- 保険料の確認",
+        "■詳細内容\n\n・終身保険の説明。\n- 解約返戻金の説明"
+    ])
+    assert merged.count("終身保険の説明") == 1
+    assert "- 保険料の確認\n- 解約返戻金の説明" in merged
+
+
+def test_merge_sections_takes_the_first_meeting_date():
+    merged = merge_sections([
+        "■面談日時・形式\n\n2025年5月27日 対面",
+        "■面談日時・形式\n\n2025年6月3日 オンライン"
+    ])
+    assert "2025年5月27日 対面" in merged
+    assert "6月3日" not in merged
+
+
+def test_merge_sections_collapses_empty_todos():
+    merged = merge_sections(["■ToDo（当方タスク）\n\n- なし", "■ToDo\n\n- 見積もりを送る"])
+    assert "- 見積もりを送る" in merged
+    assert "なし" not in merged
+    # Chunks that all have no ToDo collapse to a single なし, which is not reported missing
+    merged = merge_sections(["■ToDo\n\n- なし", "■ToDo\n\nなし"])
+    assert "■ToDo\n\nなし\n" in merged
+    assert merged.count("なし") == 1
+
+
+def test_merge_sections_recomputes_unconfirmed_items():
+    # The chunks' own 未確認 lines are dropped; only what is missing overall is reported
+    merged = merge_sections([
+        "■面談日時・形式\n\n5月27日\n\n⚠️ **未確認**: ToDo",
+        "■詳細内容\n\n- 説明\n\n⚠️ **未確認**: 面談日時・形式"
+    ])
+    assert merged.count("未確認") == 1
+    assert "⚠️ **未確認**: 決定事項・次回の予定, ToDo" in merged
+    assert "未確認" not in merge_sections([
+        "■面談日時・形式\n\n5月27日\n\n■決定事項・今後の予定\n\n- 次回面談\n\n■ToDo\n\n- なし"
+    ])
+
+
+def test_process_long_memo_merges_chunks():
+    model = FakeGenerativeModel()
+    result = process_long_memo(model, LONG_MEMO)
+    assert result["chunks"] == 2
+    assert result["failed_chunks"] == []
+    assert model.calls == 2
+    assert "■詳細内容" in result["output"]
+    assert result["unconfirmed"] == "面談日時・形式, 決定事項・次回の予定, ToDo"
+
+
+def test_process_long_memo_reports_failed_chunks():
+    # One of the two chunks times out; the other part is still returned
+    result = process_long_memo(ScriptedModel([(0.0, "ok"), (0.0, "timeout")]), LONG_MEMO)
+    assert len(result["failed_chunks"]) == 1
+    index = result["failed_chunks"][0]
+    assert result["unconfirmed"].endswith(f"未処理の部分（{index}/2）")
+    assert "■詳細内容" in result["output"]
+
+
+def test_process_long_memo_raises_when_every_chunk_fails():
+    with pytest.raises(api_exceptions.DeadlineExceeded):
+        process_long_memo(ScriptedModel([(0.0, "timeout")]), LONG_MEMO)
+
+
+def test_process_long_memo_reraises_quota_errors():
+    # A quota error is not turned into a partial result
+    with pytest.raises(api_exceptions.ResourceExhausted):
+        process_long_memo(ScriptedModel([(0.0, "ok"), (0.0, "quota")]), LONG_MEMO)
+
+
+def test_process_long_memo_retries_each_chunk():
+    model = ScriptedModel([(0.0, "quota"), (0.0, "ok")])
+    attempts = []
+
+    def retry(call):
+        for _ in range(3):
+            attempts.append(1)
+            try:
+                return call()
+            except api_exceptions.ResourceExhausted:
+                continue
+        raise AssertionError("retries exhausted")
+
+    result = process_long_memo(model, LONG_MEMO, workers=1, retry=retry)
+    assert result["failed_chunks"] == []
+    assert len(attempts) == 4
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from legacy_postprocess import legacy_extract_unconfirmed_items, legacy_remove_placeholder_names, make_memo
+from postprocess import StreamingPostProcessor, extract_unconfirmed_items, get_name_index, remove_placeholder_names
+
+SEPARATOR = "-" * 50
+GOLDEN_OUTPUTS = [
+    "■面談概要\n\n終身保険について話した。",
+    f"■ToDo\n\n- 資料送付\n\n{SEPARATOR}\n⚠️ **未確認**: 面談日時・形式, ToDo\n{SEPARATOR}\n",
+    "■ToDo\n\n- 資料送付\n\n⚠️ 未確認: 決定事項・次回の予定",
+    # Stacked separator lines around the warning
+    f"----\n{SEPARATOR}\n⚠️ **未確認**: X\n{SEPARATOR}\n----\n",
+    f"{SEPARATOR}\n{SEPARATOR}\n⚠️ 未確認: X\n{SEPARATOR}\n{SEPARATOR}\n{SEPARATOR}",
+    f"本文\n{SEPARATOR}\n\n⚠️未確認: X\n\n{SEPARATOR}\n本文",
+    # Repeated warning lines
+    f"{SEPARATOR}\n⚠️ 未確認: A\n⚠️ 未確認: B\n{SEPARATOR}",
+    "⚠️ 未確認: A\n本文\n⚠️ **未確認**: B",
+    f"{SEPARATOR}\n本文\n{SEPARATOR}\n未確認の項目は無し",
+]
+
+
+@pytest.mark.parametrize("text", GOLDEN_OUTPUTS)
+def test_extract_unconfirmed_matches_legacy(text):
+    assert extract_unconfirmed_items(text) == legacy_extract_unconfirmed_items(text)
+
+
+def test_extract_unconfirmed_matches_legacy_on_random_layouts():
+    # Line-structured outputs built from the pieces the model emits
+    pieces = ["----", SEPARATOR, "", "  ", "⚠️ **未確認**: X", "⚠️ 未確認: Y, Z", "本文", "- 項目", "■ToDo"]
+    rng = random.Random(0)
+    for _ in range(5000):
+        text = "\n".join(rng.choice(pieces) for _ in range(rng.randint(1, 8))) + rng.choice(["", "\n"])
+        assert extract_unconfirmed_items(text) == legacy_extract_unconfirmed_items(text), repr(text)
+
+
+@pytest.mark.parametrize("size", [10_000, 100_000])
+def test_postprocess_matches_legacy_on_memos(size):
+    memo, output = make_memo(size)
+    get_name_index.cache_clear()
+    text, items = extract_unconfirmed_items(output)
+    legacy_text, legacy_items = legacy_extract_unconfirmed_items(output)
+    assert items == legacy_items
+    assert remove_placeholder_names(text, memo) == legacy_remove_placeholder_names(legacy_text, memo)
+
+
+def test_remove_placeholder_names_matches_legacy_on_random_names():
+    rng = random.Random(1)
+    names = ["イサオ", "アケミ", "タカシ", "田中", "佐藤", "ナナ", "山田太郎"]
+    honorifics = ["さん", "くん", "ちゃん", "様", "氏"]
+    for _ in range(500):
+        input_text = "".join(rng.choice(names) + rng.choice(honorifics + ["", "と"]) for _ in range(3))
+        output = "、".join(rng.choice(names) + rng.choice(honorifics) for _ in range(4))
+        get_name_index.cache_clear()
+        assert remove_placeholder_names(output, input_text) == legacy_remove_placeholder_names(output, input_text)
+
+
+def test_streaming_preview_hides_the_warning_block():
+    processor = StreamingPostProcessor("イサオさんと面談")
+    text = f"■面談概要\n\nイサオさん、タカシさんが来訪\n{SEPARATOR}\n⚠️ 未確認: ToDo\n{SEPARATOR}\n"
+    for i in range(0, len(text), 7):
+        processor.feed(text[i:i + 7])
+    assert processor.preview() == "■面談概要\n\nイサオさん、顧客が来訪"
+    assert processor.unconfirmed_items == "ToDo"
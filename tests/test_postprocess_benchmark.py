@@ -0,0 +1,21 @@
+import pytest
+
+from legacy_postprocess import SIZES, make_memo
+from postprocess import extract_unconfirmed_items, get_name_index, remove_placeholder_names
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.mark.parametrize("label", list(SIZES))
+def test_postprocess_benchmark(benchmark, label):
+    memo, output = make_memo(SIZES[label])
+
+    def postprocess():
+        # Index construction is part of the measured work, not just a cached lookup
+        get_name_index.cache_clear()
+        text, items = extract_unconfirmed_items(output)
+        return remove_placeholder_names(text, memo), items
+
+    text, items = benchmark(postprocess)
+    assert items is not None
+    assert "未確認" not in text
@@ -0,0 +1,103 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """response_cache の time.time と date.today を差し替える"""
+    state = SimpleNamespace(now=1000.0, today=date(2025, 5, 27))
+
+    class FakeDate(date):
+        @classmethod
+        def today(cls):
+            return state.today
+
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(time=lambda: state.now))
+    monkeypatch.setattr(response_cache, "date", FakeDate)
+    return state
+
+
+def test_cache_key_ignores_whitespace_differences():
+    key = make_cache_key("今日は 面談\nでした", "v1", "model", 0.2, "2025-05-27")
+    assert make_cache_key("  今日は\t面談  でした\n", "v1", "model", 0.2, "2025-05-27") == key
+    assert make_cache_key("今日は 面談\nでした", "v1", "model", 0, "2025-05-27") != make_cache_key("今日は 面談\nでした", "v1", "model", 0.2, "2025-05-27")
+
+
+@pytest.mark.parametrize("change", [
+    {"input_text": "別のメモ"},
+    {"prompt_version": "v2"},
+    {"model_name": "other"},
+    {"temperature": 0.3},
+    {"day": "2025-05-28"}
+])
+def test_cache_key_changes_with_each_part(change):
+    parts = {"input_text": "メモ", "prompt_version": "v1", "model_name": "model", "temperature": 0.2, "day": "2025-05-27"}
+    assert make_cache_key(**{**parts, **change}) != make_cache_key(**parts)
+
+
+def test_cache_key_defaults_to_today(clock):
+    assert make_cache_key("メモ", "v1", "model", 0.2) == make_cache_key("メモ", "v1", "model", 0.2, "2025-05-27")
+
+
+def test_get_and_put(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("a") is None
+    cache.put("a", "応答")
+    assert cache.get("a") == "応答"
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_least_recently_used_entries_are_trimmed(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), max_entries=2)
+    cache.put("a", "A")
+    clock.now += 1
+    cache.put("b", "B")
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == "A"
+    clock.now += 1
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=60)
+    cache.put("a", "A")
+    clock.now += 60
+    assert cache.get("a") == "A"
+    clock.now += 1
+    assert cache.get("a") is None
+    # Expired rows are deleted on the next put
+    cache.put("b", "B")
+    assert cache.stats()["entries"] == 1
+
+
+def test_earlier_days_are_dropped_on_rollover(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("a", "A")
+    assert cache.get("a") == "A"
+    clock.today = date(2025, 5, 28)
+    cache.put("b", "B")
+    assert cache.get("a") is None
+    assert cache.get("b") == "B"
+    assert cache.stats()["entries"] == 1
+
+
+def test_cache_is_shared_through_the_file(tmp_path, clock):
+    ResponseCache(str(tmp_path)).put("a", "A")
+    assert ResponseCache(str(tmp_path)).get("a") == "A"
+
+
+def test_clear(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("a", "A")
+    cache.clear()
+    assert cache.get("a") is None
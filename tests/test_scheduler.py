@@ -0,0 +1,66 @@
+import threading
+import time
+
+from fake_model import FakeGenerativeModel
+from scheduler import ScheduledModel, Scheduler
+
+
+def run_sessions(scheduler, model, prompts):
+    """prompts: (session_id, prompt) を同時に送り、各 ScheduledModel を返す"""
+    models = [ScheduledModel(scheduler, model, session_id, poll_interval=0.01) for session_id, _ in prompts]
+    start = threading.Barrier(len(prompts))
+
+    def send(scheduled_model, prompt):
+        start.wait()
+        scheduled_model.generate_content(prompt)
+
+    threads = [threading.Thread(target=send, args=(m, prompt)) for m, (_, prompt) in zip(models, prompts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return models
+
+
+def test_identical_prompts_are_sent_once():
+    model = FakeGenerativeModel(latency=0.2)
+    scheduler = Scheduler(600)
+    models = run_sessions(scheduler, model, [(f"s{i}", "同じメモ") for i in range(4)])
+    assert model.calls == 1
+    assert sum(m.shared for m in models) == 3
+
+
+def test_queue_wait_is_moved_out_of_api_stages():
+    model = FakeGenerativeModel(latency=0.2)
+    scheduler = Scheduler(600, max_concurrent=1)
+    first, second = run_sessions(scheduler, model, [("a", "メモ1"), ("b", "メモ2")])
+    waited = max(first.waited, second.waited)
+    assert 0.15 < waited < 0.5
+    scheduled = first if first.waited == waited else second
+    stages = scheduled.move_wait_to_queue({"queue": 0.01, "api_ttft": 0.3, "api_total": 0.5})
+    assert stages["queue"] == round(0.01 + waited, 4)
+    assert stages["api_total"] == round(0.5 - waited, 4)
+
+
+def test_sessions_take_turns():
+    scheduler = Scheduler(600, max_concurrent=1)
+    blocker = threading.Event()
+    try:
+        first = scheduler.submit("heavy", "block", blocker.wait)
+        heavy = [scheduler.submit("heavy", f"h{i}", lambda: None) for i in range(3)]
+        light = scheduler.submit("light", "l0", lambda: None)
+        while scheduler.position(first):
+            time.sleep(0.01)
+        # The heavy session was just served, so the light one goes next
+        assert [scheduler.position(job) for job in (light, *heavy)] == [1, 2, 3, 4]
+    finally:
+        blocker.set()
+
+
+def test_requests_stay_under_the_quota():
+    # The fake model rejects more than 5 requests per second, like the API
+    model = FakeGenerativeModel(quota=(5, 1.0))
+    scheduler = Scheduler(5, period=1.0)
+    run_sessions(scheduler, model, [(f"s{i % 3}", f"メモ{i}") for i in range(12)])
+    assert scheduler.status()["retried"] == 0
+    assert model.calls == 12
@@ -0,0 +1,48 @@
+import pytest
+
+from terminology import TerminologyNormalizer, load_normalizer
+
+
+@pytest.fixture(scope="module")
+def normalizer():
+    return load_normalizer()
+
+
+@pytest.mark.parametrize("text", [
+    "あいおい損保の自動車保険",
+    "あいおい同和損保",
+    "アイオイ損害保険",
+    "あいおいニッセイ同和損保の火災保険",
+    "かんぽの宿に泊まった",
+])
+def test_non_life_insurers_are_kept(normalizer, text):
+    assert normalizer.normalize(text) == text
+
+
+@pytest.mark.parametrize("text", [
+    "かんぽうやくを飲んでいる",
+    "カンポウヤクの話",
+    "あいおいさんと面談",
+    "アイオイさんの奥様",
+    "あいおい様より連絡",
+])
+def test_kana_variants_inside_other_words_are_kept(normalizer, text):
+    assert normalizer.normalize(text) == text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("あいおいの終身", "あいおい生命の終身"),
+    ("iOSMで契約", "あいおい生命で契約"),
+    ("あいおい生命で契約", "あいおい生命で契約"),
+    ("就寝保険の解約返れい金", "終身保険の解約返戻金"),
+    ("かんぽで加入", "かんぽ生命で加入"),
+    ("あいおいから連絡", "あいおい生命から連絡"),
+    ("契約先はかんぽ。", "契約先はかんぽ生命。"),
+])
+def test_variants_are_rewritten(normalizer, text, expected):
+    assert normalizer.normalize(text) == expected
+
+
+def test_longest_match_wins():
+    normalizer = TerminologyNormalizer([{"canonical": "あいおい生命", "variants": ["あいおい"]}], keep=["あいおい損保"])
+    assert normalizer.normalize("アイオイ損保とあいおい") == "アイオイ損保とあいおい生命"